@@ -5,13 +5,32 @@ import time
 import json
 import os
 import subprocess
+import multiprocessing
+import queue
+import random
+import threading
+import contextvars
+import errno
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Iterable, AsyncIterable, Union
 import winsound
 import logging
 from dataclasses import dataclass
 from enum import Enum
 import aiofiles
+from itertools import islice
+from bisect import insort
+from urllib.parse import urljoin
+from contextlib import nullcontext
+from proxy_sweeper import TCPSweeper
+from proxy_probe import ProbeConnection, PhaseTimings, LatencyStats, build_origin_request, build_proxy_request
+from proxy_scheduler import AdaptiveLimiter, LOCAL_RESOURCE_ERRNOS, run_worker_pool
+from proxy_governor import ResourceGovernor
+from proxy_judge import HEADER_REMOTE, HEADER_REVEALING, HEADER_FORWARDED
+from proxy_geoip import open_geoip_db, ip_to_int, CIDRSet
+from proxy_enrich import EnrichmentCache, BatchEnricher, GeoIPProvider, IpApiBatchProvider
+from proxy_resolver import DNSCache, CachedResolver
+from proxy_socks import socks_open
 
 # تنظیمات لاگ‌گیری
 logging.basicConfig(
@@ -29,6 +48,7 @@ class ProxyStatus(Enum):
     FAILED = "Failed"
     TIMEOUT = "Timeout"
     ERROR = "Error"
+    SKIPPED = "Skipped"  # تست نشده - گروه subnet در نمونه‌برداری مرده تشخیص داده شد
 
 class AnonymityLevel(Enum):
     ELITE = "Elite"
@@ -47,6 +67,11 @@ class ProxyResult:
     anonymity: AnonymityLevel = AnonymityLevel.UNKNOWN
     last_checked: str = None
     isp: str = "Unknown"
+    exit_ip: str = ""
+    protocol: str = "http"  # http، socks4، socks4a یا socks5
+    timings: PhaseTimings = PhaseTimings()
+    bandwidth: int = 0  # KB/s - 0 یعنی اندازه‌گیری نشده
+    latency: LatencyStats = LatencyStats()
 
     def to_dict(self):
         return {
@@ -58,21 +83,216 @@ class ProxyResult:
             'country_code': self.country_code,
             'anonymity': self.anonymity.value,
             'last_checked': self.last_checked,
-            'isp': self.isp
+            'isp': self.isp,
+            'exit_ip': self.exit_ip,
+            'protocol': self.protocol,
+            'timings': self.timings.to_ms(),
+            'bandwidth': self.bandwidth,
+            'latency': self.latency.to_ms()
         }
 
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ProxyResult':
+        """ساخت نتیجه از دیکشنری to_dict (مثلاً نتایج پروسس‌های shard)"""
+        return cls(
+            proxy=data['proxy'],
+            ping=data['ping'],
+            http_time=data['http_time'],
+            status=ProxyStatus(data['status']),
+            country=data.get('country', 'Unknown'),
+            country_code=data.get('country_code', 'XX'),
+            anonymity=AnonymityLevel(data.get('anonymity', 'Unknown')),
+            last_checked=data.get('last_checked'),
+            isp=data.get('isp', 'Unknown'),
+            exit_ip=data.get('exit_ip', ''),
+            protocol=data.get('protocol', 'http'),
+            timings=PhaseTimings.from_ms(data.get('timings') or {}),
+            bandwidth=data.get('bandwidth', 0),
+            latency=LatencyStats.from_ms(data.get('latency') or {})
+        )
+
+# بازه‌های Cloudflare/anycast - فقط وقتی فایل cdn_ranges_file وجود ندارد استفاده می‌شود
+DEFAULT_CDN_RANGES = (
+    '173.245.48.0/20', '103.21.244.0/22', '103.22.200.0/22', '103.31.4.0/22',
+    '141.101.64.0/18', '108.162.192.0/18', '190.93.240.0/20', '188.114.96.0/20',
+    '197.234.240.0/22', '198.41.128.0/17', '162.158.0.0/15', '104.16.0.0/13',
+    '104.24.0.0/14', '172.64.0.0/13', '131.0.72.0/22',
+    '45.131.4.0/22', '45.131.208.0/22',
+)
+
+# زمان مراحل probe جاری (نانوثانیه) - هر probe دیکشنری خودش را دارد و
+# تسک‌های فرزند (مثلاً race) به همان دیکشنری می‌نویسند
+_probe_phases: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar('probe_phases', default=None)
+
+
+# اتصال probe که برای نمونه‌برداری latency باز می‌ماند: [(اتصال، TTFB پاسخ probe)]
+# None یعنی نمونه‌برداری خاموش است و probe ها اتصال را می‌بندند
+_probe_reuse: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('probe_reuse', default=None)
+
+
+def _reuse_requested() -> bool:
+    """آیا probe جاری باید درخواست keep-alive بفرستد و اتصالش را نگه دارد"""
+    kept = _probe_reuse.get()
+    return kept is not None and not kept
+
+
+def _is_reusable(headers: dict) -> bool:
+    """پاسخ با Content-Length و بدون Connection: close - مرز پاسخ بعدی معلوم است"""
+    return headers.get('content-length', '').isdigit() and 'close' not in (
+        headers.get('connection', '') + headers.get('proxy-connection', '')).lower()
+
+
+async def _keep_for_sampling(conn: ProbeConnection, response, timeout: float) -> bool:
+    """خواندن بدنه پاسخ 200 و نگه داشتن اتصال برای نمونه‌برداری - True اگر اتصال نگه داشته شد"""
+    kept = _probe_reuse.get()
+    if kept is None or kept or response.status != 200 or not _is_reusable(response.headers):
+        return False
+    length = int(response.headers['content-length'])
+    try:
+        received, _ = await conn.receive_body(length, timeout)
+    except Exception:
+        return False
+    # بدنه ناقص یا اضافه یعنی مرز پاسخ بعدی معلوم نیست
+    if received != length or conn.is_closed:
+        return False
+    kept.append((conn, response.elapsed_ns))
+    return True
+
+
+# خطاهای probe های HTTP پروکسی جاری - برای تصمیم امتحان SOCKS بعد از شکست HTTP
+_probe_errors: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('probe_errors', default=None)
+
+
+def _note_probe_error(exc: BaseException):
+    errors = _probe_errors.get()
+    if errors is not None:
+        errors.append(exc)
+
+
+def _record_phases(**phases: Optional[int]):
+    """ثبت زمان مراحل درخواست موفق - اولین درخواست موفق برنده است"""
+    current = _probe_phases.get()
+    if current is not None and 'ttfb' not in current:
+        current.update((name, value) for name, value in phases.items() if value is not None)
+
+
+def _phase_trace_config() -> aiohttp.TraceConfig:
+    """ثبت زمان DNS، اتصال و TTFB درخواست‌های aiohttp در trace_request_ctx"""
+    async def mark(name: str, ctx):
+        if isinstance(ctx.trace_request_ctx, dict):
+            ctx.trace_request_ctx[name] = time.perf_counter_ns()
+    
+    trace_config = aiohttp.TraceConfig()
+    for signal, name in ((trace_config.on_dns_resolvehost_start, 'dns_start'),
+                         (trace_config.on_dns_resolvehost_end, 'dns_end'),
+                         (trace_config.on_connection_create_start, 'connect_start'),
+                         (trace_config.on_connection_create_end, 'connect_end'),
+                         (trace_config.on_request_headers_sent, 'sent'),
+                         (trace_config.on_request_end, 'headers')):
+        signal.append(lambda session, ctx, params, name=name: mark(name, ctx))
+    return trace_config
+
+
+def _record_aiohttp_phases(marks: dict, tunneled: bool):
+    """تبدیل نشانه‌های trace به مراحل - برای https ایجاد اتصال شامل CONNECT و TLS است"""
+    def span(start: str, end: str) -> Optional[int]:
+        return marks[end] - marks[start] if start in marks and end in marks else None
+    
+    connect = span('connect_start', 'connect_end')
+    _record_phases(dns=span('dns_start', 'dns_end'),
+                   tcp=None if tunneled else connect,
+                   connect=connect if tunneled else None,
+                   ttfb=span('sent', 'headers'))
+
+# هدرهای پاسخ judge که probe سبک باید پارس کند
+_JUDGE_WANTED = tuple(h.lower().encode() for h in (HEADER_REMOTE, HEADER_REVEALING, HEADER_FORWARDED))
+
+# هدرهای لازم برای تشخیص پایان بدنه و ماندگاری اتصال
+_FRAMING_WANTED = (b'content-length', b'connection', b'proxy-connection')
+
 class ProxyBackend:
     def __init__(self):
         self.proxy_list: List[str] = []
+        self.proxy_file: Optional[str] = None
         self.test_results: List[ProxyResult] = []
         self.best_proxy: Optional[str] = None
         self.is_testing: bool = False
         self.working_proxies_file: str = "working_proxies_live.txt"
         self.config_file: str = "config.json"
+        self.concurrency_history: List[tuple] = []
+        self.resource_throttles: int = 0
+        self.time_to_first_active: Optional[int] = None
+        self._real_ips: Optional[set] = None
+        self._limiter: Optional[AdaptiveLimiter] = None
+        # حلقه و event توقف اسکن جاری - stop_testing از thread رابط کاربری صدا زده می‌شود
+        self._scan_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._stop_time: float = 0.0
+        self.cdn_skipped: int = 0
+        self._cdn_sample_left: int = 0
+        self.incremental_kept: int = 0
         
         # تنظیمات پیشرفته
         self.settings = {
             'max_workers': 50,
+            'connect_workers': 500,
+            'enrich_workers': 10,
+            'concurrency_mode': 'fixed',  # fixed یا adaptive (AIMD مشترک برای مراحل connect و probe)
+            'adaptive_min': 20,
+            'adaptive_max': 1000,
+            'resource_governor': True,
+            'governor_max_sockets': 8000,
+            'governor_max_time_wait': 20000,
+            'governor_max_rss_mb': 1024,  # فقط هشدار، اسکن متوقف نمی‌شود
+            'governor_max_wait': 10,  # حداکثر مکث هر اتصال زیر فشار منابع (ثانیه)
+            'connect_mode': 'async',  # async یا sweep
+            'sweep_inflight': 10000,
+            'sweep_chunk': 5000,
+            'scan_mode': 'pipeline',  # pipeline، sharded (چند پروسس) یا sampling (نمونه‌برداری از subnet ها)
+            'shard_processes': 0,  # 0 = تعداد هسته‌ها
+            'stream_queue_size': 1000,
+            'stream_load': False,  # تست همزمان با خواندن فایل پروکسی به جای لود کامل قبل از تست
+            'stop_deadline': 0.2,  # حداکثر ثانیه انتظار برای لغو probe های در جریان بعد از Stop
+            'topk_count': 10,  # جستجوی سریع: توقف بعد از پیدا شدن این تعداد پروکسی خوب
+            'topk_max_latency': 2000,  # سقف http_time (ms) برای پروکسی خوب
+            'topk_budget': 30,  # حداکثر ثانیه جستجوی سریع
+            'smart_connect_candidates': 8,  # تعداد پروکسی کش شده که GO همزمان امتحان می‌کند
+            'smart_connect_timeout': 3,
+            'incremental': False,  # فقط پروکسی‌های جدید یا نتایج قدیمی‌تر از TTL دوباره تست می‌شوند
+            'rescan_ttl_active': 600,  # ثانیه - نتایج Active/Error زودتر کهنه می‌شوند
+            'rescan_ttl_failed': 3600,
+            'sampling_prefix': 24,  # طول prefix برای گروه‌بندی در حالت sampling
+            'sampling_size': 3,  # تعداد نمونه تصادفی از هر گروه
+            'sampling_min_group': 8,  # گروه‌های کوچک‌تر کامل تست می‌شوند
+            'sampling_hit_rate': 0.0,  # گروه فقط اگر نرخ موفقیت نمونه‌ها بیشتر از این باشد کامل تست می‌شود
+            'probe_mode': 'aiohttp',  # aiohttp یا native (کلاینت سبک روی اتصال مرحله TCP)
+            'geoip_db': 'geoip.dat',  # ساخته شده با: python proxy_geoip.py build input.csv geoip.dat
+            'enrich_mode': 'inline',  # inline یا deferred (انتشار فوری و enrichment دسته‌ای)
+            'enrich_provider': 'auto',  # auto، geoip یا ip-api
+            'enrich_batch_size': 100,
+            'enrich_cache_file': 'enrich_cache.json',
+            'enrich_cache_ttl': 86400,
+            'enrich_cache_size': 50000,
+            'dns_min_ttl': 30,
+            'dns_max_ttl': 3600,
+            'dns_negative_ttl': 60,  # نام‌های resolve نشده تا این مدت دوباره پرسیده نمی‌شوند
+            'judge_url': '',  # آدرس proxy_judge.py روی سرور خودمان - خالی = غیرفعال
+            'latency_samples': 0,  # تعداد درخواست پشت سر هم روی اتصال keep-alive برای p50/p95/jitter - 0 = غیرفعال
+            'rank_by': 'http_time',  # معیار بهترین پروکسی: http_time، p50 یا p95
+            'probe_policy': 'sequential',  # sequential یا race (همه test_urls همزمان)
+            'socks_detect': True,  # تشخیص SOCKS4/5 برای پروکسی‌هایی که HTTP جواب نمی‌دهند
+            'socks_ports': [1080, 1081, 4145, 4153, 5678, 9050, 10808],  # روی این پورت‌ها اول SOCKS تست می‌شود
+            'socks_greeting_timeout': 3,
+            'cdn_filter': True,  # رد کردن پروکسی‌های روی بازه‌های CDN/anycast
+            'cdn_ranges_file': 'cdn_ranges.txt',
+            'cdn_sample': 3,  # تعداد پروکسی CDN که باز هم تست می‌شوند
+            'bandwidth_test': False,  # مرحله دوم: تست پهنای باند بهترین پروکسی‌ها بعد از اسکن
+            'bandwidth_url': '',  # http:// آدرس /payload سرور خودمان - خالی = /payload روی judge_url
+            'bandwidth_top_n': 10,
+            'bandwidth_bytes': 2000000,  # حجم payload درخواستی
+            'bandwidth_duration': 10,  # حداکثر ثانیه دریافت برای هر پروکسی
+            'bandwidth_concurrency': 2,  # تست‌های همزمان تا روی لینک خودمان با هم رقابت نکنند
+            'bandwidth_min_kbps': 100,  # پروکسی کندتر از این بهترین پروکسی انتخاب نمی‌شود
             'timeout': 8,
             'test_urls': [
                 'http://www.google.com',
@@ -87,6 +307,27 @@ class ProxyBackend:
         # لود تنظیمات
         self.load_settings()
         
+        # پایگاه داده آفلاین GeoIP (اختیاری)
+        self.geoip = open_geoip_db(self.settings['geoip_db'])
+        
+        # کش DNS مشترک برای اتصال TCP و probe های HTTP
+        self.dns = DNSCache(
+            min_ttl=self.settings['dns_min_ttl'],
+            max_ttl=self.settings['dns_max_ttl'],
+            negative_ttl=self.settings['dns_negative_ttl']
+        )
+        
+        # بازه‌های CDN برای پیش‌فیلتر
+        self.cdn_ranges = self._load_cdn_ranges()
+        
+        # کش کشور/ISP بین اجراها
+        self.enrich_cache = EnrichmentCache(
+            path=self.settings['enrich_cache_file'],
+            ttl=self.settings['enrich_cache_ttl'],
+            max_size=self.settings['enrich_cache_size']
+        )
+        self.enrich_cache.load()
+        
         # ایجاد فایل working پروکسی‌ها اگر وجود ندارد
         self._ensure_working_proxies_file()
     
@@ -123,33 +364,97 @@ class ProxyBackend:
             if not os.path.exists(filename):
                 return True, "No proxy file found. Please load a proxy file or add proxies manually."
             
-            with open(filename, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            loaded_proxies = []
-            seen_proxies = set()
+            self.proxy_file = filename
+            if self.settings['stream_load']:
+                # فایل هنگام شروع تست با run_stream_test_async به صورت تدریجی خوانده می‌شود
+                return True, f"📄 {os.path.basename(filename)} will be streamed when the test starts"
             
-            for line in lines:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    # پشتیبانی از فرمت‌های مختلف
-                    proxy = self._parse_proxy_line(line)
-                    if proxy and proxy not in seen_proxies:
-                        loaded_proxies.append(proxy)
-                        seen_proxies.add(proxy)
-            
-            self.proxy_list = loaded_proxies
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.proxy_list = list(self._iter_parsed_proxies(f, set()))
             
             # لود پروکسی‌های working اگر وجود دارند
             self._load_working_proxies()
             
             logger.info(f"Loaded {len(self.proxy_list)} unique proxies from {filename}")
-            return True, f"✅ {len(self.proxy_list)} unique proxies loaded"
+            message = f"✅ {len(self.proxy_list)} unique proxies loaded"
+            if self.settings['cdn_filter']:
+                on_cdn = sum(1 for proxy in self.proxy_list if self._is_cdn_proxy(proxy))
+                if on_cdn:
+                    message += f" ({on_cdn} on CDN ranges will be skipped)"
+            return True, message
             
         except Exception as e:
             logger.error(f"Error loading proxies: {e}")
             return False, f"❌ Error loading file: {str(e)}"
     
+    def _iter_parsed_proxies(self, lines: Iterable[str], seen: set):
+        """پارس خطوط و حذف تکراری‌ها به صورت تدریجی"""
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                # پشتیبانی از فرمت‌های مختلف
+                proxy = self._parse_proxy_line(line)
+                if proxy and proxy not in seen:
+                    seen.add(proxy)
+                    yield proxy
+
+    def _load_cdn_ranges(self) -> CIDRSet:
+        """لود بازه‌های CDN از فایل محلی یا لیست پیش‌فرض"""
+        path = self.settings['cdn_ranges_file']
+        if path and os.path.exists(path):
+            try:
+                ranges = CIDRSet.from_file(path)
+                logger.info(f"CDN ranges loaded: {len(ranges)} ranges from {path}")
+                return ranges
+            except OSError as e:
+                logger.error(f"Error loading CDN ranges: {e}")
+        return CIDRSet(DEFAULT_CDN_RANGES)
+
+    def _is_cdn_proxy(self, proxy: str) -> bool:
+        return proxy.rsplit(':', 1)[0] in self.cdn_ranges
+
+    def _reset_cdn_filter(self):
+        self.cdn_skipped = 0
+        self._cdn_sample_left = self.settings['cdn_sample']
+
+    def _passes_cdn_filter(self, proxy: str) -> bool:
+        """False برای پروکسی روی بازه CDN - چند نمونه اول همچنان تست می‌شوند"""
+        if not self.settings['cdn_filter'] or not self._is_cdn_proxy(proxy):
+            return True
+        if self._cdn_sample_left > 0:
+            self._cdn_sample_left -= 1
+            return True
+        self.cdn_skipped += 1
+        return False
+
+    async def _stream_proxies_from_file(self, filename: str, out_queue: asyncio.Queue):
+        """پارس تدریجی فایل و ارسال پروکسی‌ها به صف محدود"""
+        seen = set(self.proxy_list)
+        pending = ''
+        try:
+            async with aiofiles.open(filename, 'r', encoding='utf-8') as f:
+                while self.is_testing:
+                    chunk = await f.read(16384)
+                    if not chunk:
+                        break
+                    lines = (pending + chunk).split('\n')
+                    pending = lines.pop()
+                    for proxy in self._iter_parsed_proxies(lines, seen):
+                        self.proxy_list.append(proxy)
+                        await out_queue.put(proxy)
+            
+            # خط آخر و سپس پروکسی‌های working کش شده
+            tail = [pending]
+            if os.path.exists(self.working_proxies_file):
+                async with aiofiles.open(self.working_proxies_file, 'r', encoding='utf-8') as f:
+                    tail += (await f.read()).split('\n')
+            for proxy in self._iter_parsed_proxies(tail, seen):
+                self.proxy_list.append(proxy)
+                await out_queue.put(proxy)
+        finally:
+            # sentinel پایان فایل
+            await out_queue.put(None)
+
     def _parse_proxy_line(self, line: str) -> str:
         """پارس کردن خط پروکسی با پشتیبانی از فرمت‌های مختلف"""
         line = line.strip()
@@ -194,55 +499,506 @@ class ProxyBackend:
 
     async def test_proxy_async(self, proxy: str, session: aiohttp.ClientSession) -> ProxyResult:
         """تست پروکسی به صورت ناهمزمان با پشتیبانی کامل"""
-        start_time = time.time()
-        
         try:
-            ip, port = proxy.split(':')
+            if self.settings['judge_url'] and self._real_ips is None:
+                await self._load_real_ip(session)
             
             # تست اتصال TCP با asyncio (غیر بلاک‌کننده)
-            try:
-                tcp_start = time.time()
-                conn = asyncio.open_connection(ip, int(port))
-                reader, writer = await asyncio.wait_for(conn, timeout=5)
-                writer.close()
-                await writer.wait_closed()
-                connect_time = int((time.time() - tcp_start) * 1000)
-            except (asyncio.TimeoutError, ConnectionRefusedError, ConnectionResetError, OSError) as e:
-                logger.debug(f"TCP connection failed for {proxy}: {e}")
+            conn = await self._open_tcp(proxy)
+            if conn is None:
                 return ProxyResult(proxy, 9999, 9999, ProxyStatus.FAILED)
+            phases = {'dns': conn.dns_ns, 'tcp': conn.connect_ns}
+            if self.settings['probe_mode'] != 'native':
+                conn.close()
             
-            # تست HTTP
-            http_time, http_success = await self._test_http_proxy(proxy, session)
-            
-            if not http_success and self.settings['test_https']:
-                # تست HTTPS اگر HTTP شکست خورد
-                http_time, http_success = await self._test_https_proxy(proxy, session)
+            # تست HTTP/HTTPS
+            result = await self._probe_proxy(proxy, conn.connect_ms, session,
+                                             conn if self.settings['probe_mode'] == 'native' else None, phases)
             
-            if http_success:
+            if result.status == ProxyStatus.ACTIVE:
                 # تشخیص کشور و anonymity
-                country, country_code, anonymity, isp = await self._detect_proxy_info(ip, session)
-                
-                # ذخیره سریع پروکسی سالم - فقط اگر http_time کمتر از 3000 باشد
-                if http_time < 3000:
-                    await self._save_working_proxy_immediately(proxy)
-                
-                return ProxyResult(
-                    proxy=proxy,
-                    ping=connect_time,
-                    http_time=http_time,
-                    status=ProxyStatus.ACTIVE,
-                    country=country,
-                    country_code=country_code,
-                    anonymity=anonymity,
-                    isp=isp,
-                    last_checked=datetime.now().isoformat()
-                )
-            else:
-                return ProxyResult(proxy, connect_time, 9999, ProxyStatus.FAILED)
+                await self._enrich_result(result, session)
+            
+            return result
             
         except Exception as e:
             logger.debug(f"Error testing proxy {proxy}: {e}")
-            return ProxyResult(proxy, 9999, 9999, ProxyStatus.ERROR)    
+            return ProxyResult(proxy, 9999, 9999, ProxyStatus.ERROR)
+
+    async def _resolve_proxy(self, proxy: str) -> tuple[str, int]:
+        """(آی‌پی، پورت) پروکسی - hostname از طریق کش DNS"""
+        host, port = proxy.rsplit(':', 1)
+        addresses = await self.dns.resolve(host)
+        return addresses[0], int(port)
+
+    async def _open_tcp(self, proxy: str) -> Optional[ProbeConnection]:
+        """باز کردن اتصال TCP به پروکسی - اتصال باز یا None"""
+        try:
+            dns_start = time.perf_counter_ns()
+            ip, port = await self._resolve_proxy(proxy)
+            dns_ns = time.perf_counter_ns() - dns_start
+            conn = await ProbeConnection.open(ip, port, timeout=5)
+            conn.dns_ns = dns_ns
+            self._record_connect_outcome(None)
+            return conn
+        except (asyncio.TimeoutError, ConnectionRefusedError, ConnectionResetError, OSError) as e:
+            self._record_connect_outcome(e)
+            if isinstance(e, OSError) and e.errno in LOCAL_RESOURCE_ERRNOS:
+                # کمبود منابع محلی ربطی به پروکسی ندارد - به فراخواننده اطلاع بده
+                raise
+            logger.debug(f"TCP connection failed for {proxy}: {e}")
+            return None
+
+    def _record_connect_outcome(self, exc: Optional[BaseException]):
+        """ارسال نتیجه اتصال به کنترل‌کننده همزمانی (در حالت adaptive)"""
+        if self._limiter:
+            self._limiter.record_exception(exc)
+
+    async def _test_http_native(self, proxy: str, conn: ProbeConnection = None) -> tuple[int, bool]:
+        """تست HTTP با کلاینت سبک proxy_probe - اولین URL روی اتصال مرحله TCP"""
+        for url in self.settings['test_urls']:
+            if not url.startswith('http://'):
+                continue
+            
+            try:
+                elapsed = await self._fetch_via_native(proxy, url, conn)
+                if elapsed is not None:
+                    return elapsed, True
+            except Exception as e:
+                _note_probe_error(e)
+                continue
+            finally:
+                conn = None
+        
+        return 9999, False
+
+    async def _fetch_via_native(self, proxy: str, url: str, conn: ProbeConnection = None) -> Optional[int]:
+        """یک درخواست با کلاینت سبک - زمان در صورت 200 و در غیر این صورت None"""
+        if conn is None or conn.is_closed:
+            ip, port = await self._resolve_proxy(proxy)
+            conn = await ProbeConnection.open(ip, port, timeout=self.settings['timeout'])
+            fresh_tcp = conn.connect_ns
+        else:
+            fresh_tcp = None
+        keep_alive = _reuse_requested()
+        try:
+            response = await conn.request(build_proxy_request(url, keep_alive), timeout=self.settings['timeout'],
+                                          wanted=_FRAMING_WANTED if keep_alive else ())
+            if response.status != 200:
+                return None
+            _record_phases(tcp=fresh_tcp, ttfb=response.elapsed_ns)
+            if keep_alive and await _keep_for_sampling(conn, response, self.settings['timeout']):
+                conn = None
+            return response.elapsed_ms
+        finally:
+            if conn:
+                conn.close()
+
+    async def _fetch_via_aiohttp(self, proxy: str, url: str, session: aiohttp.ClientSession) -> Optional[int]:
+        """یک درخواست با aiohttp - زمان در صورت 200 و در غیر این صورت None"""
+        http_start = time.time()
+        marks = {}
+        async with session.get(
+            url,
+            proxy=f'http://{proxy}',
+            timeout=aiohttp.ClientTimeout(total=self.settings['timeout']),
+            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+            ssl=False if url.startswith('http://') else None,
+            trace_request_ctx=marks
+        ) as response:
+            if response.status == 200:
+                _record_aiohttp_phases(marks, url.startswith('https://'))
+                return int((time.time() - http_start) * 1000)
+        return None
+
+    @staticmethod
+    def _is_proxy_failure(exc: BaseException) -> bool:
+        """آیا خطا قطعاً مربوط به خود پروکسی است (نه سایت مقصد)؟"""
+        if isinstance(exc, (aiohttp.ClientConnectorError, aiohttp.ClientHttpProxyError,
+                            aiohttp.ServerDisconnectedError)):
+            # اتصال به پروکسی ممکن نیست، CONNECT رد شد یا پروکسی اتصال را بست
+            return True
+        if isinstance(exc, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+            # timeout می‌تواند از سمت مقصد باشد
+            return False
+        if isinstance(exc, (ConnectionResetError, ConnectionRefusedError, BrokenPipeError)):
+            return True
+        # پاسخ غیر HTTP از پروکسی (status line نامعتبر)
+        return isinstance(exc, ValueError)
+
+    async def _race_probes(self, proxy: str, session: aiohttp.ClientSession,
+                           conn: ProbeConnection = None) -> tuple[int, bool]:
+        """اجرای همزمان همه test_urls - اولین 200 برنده است و خطای پروکسی بقیه را لغو می‌کند"""
+        native = self.settings['probe_mode'] == 'native'
+        attempts = []
+        
+        for url in self.settings['test_urls']:
+            if url.startswith('http://'):
+                if native:
+                    # اولین درخواست HTTP روی اتصال مرحله TCP
+                    attempts.append(asyncio.create_task(self._fetch_via_native(proxy, url, conn)))
+                    conn = None
+                else:
+                    attempts.append(asyncio.create_task(self._fetch_via_aiohttp(proxy, url, session)))
+            elif url.startswith('https://') and self.settings['test_https']:
+                attempts.append(asyncio.create_task(self._fetch_via_aiohttp(proxy, url, session)))
+        
+        if conn:
+            conn.close()
+        
+        try:
+            for next_done in asyncio.as_completed(attempts):
+                try:
+                    elapsed = await next_done
+                except Exception as e:
+                    _note_probe_error(e)
+                    if self._is_proxy_failure(e):
+                        logger.debug(f"Proxy-level failure for {proxy}, aborting race: {e!r}")
+                        return 9999, False
+                    continue
+                if elapsed is not None:
+                    return elapsed, True
+            return 9999, False
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def _load_real_ip(self, session: aiohttp.ClientSession):
+        """آی‌پی واقعی ما از دید judge - برای تشخیص پروکسی‌های transparent"""
+        self._real_ips = set()
+        try:
+            async with session.get(
+                self.settings['judge_url'],
+                timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                remote = response.headers.get(HEADER_REMOTE)
+                if remote:
+                    self._real_ips.add(remote)
+                    logger.info(f"Judge sees our address as {remote}")
+        except Exception as e:
+            logger.warning(f"Judge not reachable directly: {e}")
+
+    async def _judge_probe(self, proxy: str, session: aiohttp.ClientSession,
+                           conn: ProbeConnection = None) -> Optional[tuple[int, str, AnonymityLevel]]:
+        """probe از طریق judge - (زمان، آی‌پی خروجی، anonymity) یا None"""
+        url = self.settings['judge_url']
+        # زمان مراحل فقط اگر پاسخ واقعاً از judge باشد ثبت می‌شود
+        native_phases = None
+        trace = {}
+        try:
+            if self.settings['probe_mode'] == 'native':
+                if conn is None or conn.is_closed:
+                    ip, port = await self._resolve_proxy(proxy)
+                    conn = await ProbeConnection.open(ip, port, timeout=self.settings['timeout'])
+                    fresh_tcp = conn.connect_ns
+                else:
+                    fresh_tcp = None
+                keep_alive = _reuse_requested()
+                try:
+                    response = await conn.request(build_proxy_request(url, keep_alive), timeout=self.settings['timeout'],
+                                                  wanted=_JUDGE_WANTED + _FRAMING_WANTED if keep_alive else _JUDGE_WANTED)
+                    if (keep_alive and response.headers.get(HEADER_REMOTE.lower())
+                            and await _keep_for_sampling(conn, response, self.settings['timeout'])):
+                        conn = None
+                finally:
+                    if conn:
+                        conn.close()
+                status, headers, elapsed = response.status, response.headers, response.elapsed_ms
+                native_phases = {'tcp': fresh_tcp, 'ttfb': response.elapsed_ns}
+            else:
+                http_start = time.time()
+                async with session.get(
+                    url,
+                    proxy=f'http://{proxy}',
+                    timeout=aiohttp.ClientTimeout(total=self.settings['timeout']),
+                    ssl=False,
+                    trace_request_ctx=trace
+                ) as response:
+                    status = response.status
+                    headers = {name: response.headers[name] for name in map(bytes.decode, _JUDGE_WANTED)
+                               if name in response.headers}
+                elapsed = int((time.time() - http_start) * 1000)
+        except Exception as e:
+            _note_probe_error(e)
+            logger.debug(f"Judge probe failed for {proxy}: {e}")
+            return None
+        
+        if status != 200 or not headers.get(HEADER_REMOTE.lower()):
+            # پاسخ از judge نیامده (مثلاً صفحه خطای خود پروکسی)
+            return None
+        if native_phases:
+            _record_phases(**native_phases)
+        else:
+            _record_aiohttp_phases(trace, url.startswith('https://'))
+        exit_ip, anonymity = self._classify_judge_headers(headers)
+        return elapsed, exit_ip, anonymity
+
+    def _classify_judge_headers(self, headers: dict) -> tuple[str, AnonymityLevel]:
+        """تشخیص سطح anonymity از گزارش judge"""
+        exit_ip = headers.get(HEADER_REMOTE.lower(), '')
+        forwarded = headers.get(HEADER_FORWARDED.lower(), '')
+        revealing = headers.get(HEADER_REVEALING.lower(), '')
+        
+        real_ips = self._real_ips or set()
+        if exit_ip in real_ips or any(ip in forwarded for ip in real_ips):
+            return exit_ip, AnonymityLevel.TRANSPARENT
+        if revealing:
+            return exit_ip, AnonymityLevel.ANONYMOUS
+        return exit_ip, AnonymityLevel.ELITE
+
+    async def _probe_proxy(self, proxy: str, connect_time: int, session: aiohttp.ClientSession,
+                           conn: ProbeConnection = None, phases: dict = None,
+                           should_continue: Callable[[], bool] = None) -> ProxyResult:
+        """مرحله دوم: probe با ثبت زمان هر مرحله در result.timings
+        
+        phases زمان DNS/TCP مرحله اتصال به نانوثانیه است؛ بدون آن (حالت sweep)
+        از connect_time استفاده می‌شود. should_continue نمونه‌برداری latency را با Stop قطع می‌کند.
+        """
+        phases = dict(phases or {'tcp': connect_time * 1_000_000})
+        connect_stage = phases.get('dns', 0) + phases.get('tcp', 0)
+        token = _probe_phases.set(phases)
+        # با نمونه‌برداری latency، probe موفق اتصال keep-alive خود را در kept می‌گذارد
+        kept = [] if self.settings['latency_samples'] > 1 else None
+        reuse_token = _probe_reuse.set(kept)
+        start = time.perf_counter_ns()
+        try:
+            result = await self._probe_protocols(proxy, connect_time, session, conn)
+        except BaseException:
+            if kept:
+                kept[0][0].abort()
+            raise
+        finally:
+            _probe_reuse.reset(reuse_token)
+            _probe_phases.reset(token)
+        if result.status == ProxyStatus.ACTIVE:
+            phases['total'] = connect_stage + time.perf_counter_ns() - start
+            if kept is not None:
+                result.latency = await self._sample_latency(result, kept[0] if kept else None, should_continue)
+        elif kept:
+            kept[0][0].abort()
+        result.timings = PhaseTimings.from_ns(phases)
+        return result
+
+    async def _probe_protocols(self, proxy: str, connect_time: int, session: aiohttp.ClientSession,
+                               conn: ProbeConnection = None) -> ProxyResult:
+        """تشخیص پروتکل و تست HTTP/HTTPS یا SOCKS"""
+        if not self.settings['socks_detect']:
+            return await self._probe_http(proxy, connect_time, session, conn)
+        
+        socks_port = int(proxy.rsplit(':', 1)[1]) in self.settings['socks_ports']
+        if socks_port:
+            # تشخیص روی اتصال مرحله TCP؛ بعد از آن اتصال مصرف شده است
+            result = await self._probe_socks(proxy, connect_time, conn)
+            if result:
+                return result
+            conn = None
+        
+        errors = []
+        token = _probe_errors.set(errors)
+        try:
+            result = await self._probe_http(proxy, connect_time, session, conn)
+        finally:
+            _probe_errors.reset(token)
+        if result.status != ProxyStatus.ACTIVE and not socks_port and self._suggests_socks(errors):
+            result = await self._probe_socks(proxy, connect_time, reset_is_socks4=False) or result
+        return result
+
+    @staticmethod
+    def _suggests_socks(errors: List[BaseException]) -> bool:
+        """آیا شکست HTTP شبیه پاسخ سرور SOCKS است؟
+
+        فقط شکست سریع در سطح پروتکل (status line نامعتبر، بستن یا reset اتصال) - بعد از هر timeout
+        امتحان SOCKS یعنی سوزاندن یک timeout دیگر روی پروکسی مرده.
+        """
+        if any(isinstance(e, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)) for e in errors):
+            return False
+        return any(isinstance(e, (ValueError, ConnectionResetError, BrokenPipeError, aiohttp.ServerDisconnectedError))
+                   or (isinstance(e, aiohttp.ClientOSError) and e.errno == errno.ECONNRESET)
+                   # پاسخ نامعتبر؛ رد CONNECT با status یعنی پروکسی HTTP است
+                   or (isinstance(e, aiohttp.ClientResponseError) and not isinstance(e, aiohttp.ClientHttpProxyError))
+                   for e in errors)
+
+    async def _probe_socks(self, proxy: str, connect_time: int, conn: ProbeConnection = None,
+                           reset_is_socks4: bool = True) -> Optional[ProxyResult]:
+        """probe پروکسی SOCKS4/4a/5 تا judge یا اولین test_url - نتیجه ACTIVE یا None
+
+        conn اتصال مرحله TCP است (در صورت وجود) و در هر حال بسته می‌شود.
+        """
+        judge_url = self.settings['judge_url']
+        url = self._origin_probe_url()
+        timeout = self.settings['timeout']
+        keep_alive = _reuse_requested()
+        wanted = _JUDGE_WANTED if judge_url else ()
+        try:
+            ip, port = await self._resolve_proxy(proxy)
+            start = time.perf_counter_ns()
+            socks_phases = {}
+            protocol, conn = await socks_open(
+                ip, port, url, timeout,
+                greeting_timeout=self.settings['socks_greeting_timeout'],
+                resolve=self.dns.resolve,
+                phases=socks_phases,
+                conn=conn,
+                reset_is_socks4=reset_is_socks4
+            )
+            try:
+                response = await conn.request(build_origin_request(url, keep_alive), timeout,
+                                              wanted + _FRAMING_WANTED if keep_alive else wanted)
+                socks_phases['ttfb'] = response.elapsed_ns
+                elapsed = (time.perf_counter_ns() - start) // 1_000_000
+                if (keep_alive and (not judge_url or response.headers.get(HEADER_REMOTE.lower()))
+                        and await _keep_for_sampling(conn, response, timeout)):
+                    conn = None
+            finally:
+                if conn:
+                    conn.close()
+        except Exception as e:
+            if conn:
+                conn.close()
+            logger.debug(f"SOCKS probe failed for {proxy}: {e}")
+            return None
+        
+        if response.status != 200:
+            return None
+        result = ProxyResult(proxy, connect_time, elapsed, ProxyStatus.ACTIVE, protocol=protocol)
+        if judge_url:
+            if not response.headers.get(HEADER_REMOTE.lower()):
+                return None
+            result.exit_ip, result.anonymity = self._classify_judge_headers(response.headers)
+        _record_phases(**socks_phases)
+        return result
+
+    def _origin_probe_url(self) -> str:
+        """آدرس probe روی اتصال خام: judge یا اولین test_url با http"""
+        test_urls = self.settings['test_urls']
+        return self.settings['judge_url'] or next((u for u in test_urls if u.startswith('http://')), test_urls[0])
+
+    async def _open_through(self, proxy: str, protocol: str, url: str,
+                            keep_alive: bool = False) -> tuple[ProbeConnection, bytes]:
+        """اتصال جدید از طریق پروکسی با پروتکل تشخیص داده شده - (اتصال، درخواست GET برای url)"""
+        timeout = self.settings['timeout']
+        ip, port = await self._resolve_proxy(proxy)
+        if protocol == 'http':
+            conn = await ProbeConnection.open(ip, port, timeout)
+        else:
+            _, conn = await socks_open(ip, port, url, timeout,
+                                       greeting_timeout=self.settings['socks_greeting_timeout'],
+                                       resolve=self.dns.resolve)
+        return conn, self._request_through(protocol, url, keep_alive)
+
+    @staticmethod
+    def _request_through(protocol: str, url: str, keep_alive: bool = False) -> bytes:
+        """درخواست GET برای url روی اتصالی از طریق پروکسی با این پروتکل"""
+        if protocol == 'http':
+            return build_proxy_request(url, keep_alive)
+        return build_origin_request(url, keep_alive)
+
+    async def _sample_latency(self, result: ProxyResult,
+                              kept: Optional[tuple[ProbeConnection, int]] = None,
+                              should_continue: Callable[[], bool] = None) -> LatencyStats:
+        """latency_samples درخواست پشت سر هم روی یک اتصال keep-alive و توزیع TTFB آن‌ها
+
+        kept اتصال باز خود probe و TTFB آن است؛ نمونه‌ها روی همان اتصال ادامه می‌یابند.
+        اگر probe اتصال را نگه نداشته باشد، پروکسی اتصال را نگه ندارد یا پاسخ
+        Content-Length نداشته باشد، اتصال جدید باز می‌شود و keep_alive نتیجه False است.
+        بدون should_continue (تست تکی) همه نمونه‌ها گرفته می‌شوند.
+        """
+        url = self._origin_probe_url()
+        timeout = self.settings['timeout']
+        request = self._request_through(result.protocol, url, keep_alive=True)
+        samples = []
+        connections = 0
+        conn = None
+        if kept:
+            conn, first_ttfb = kept
+            samples.append(first_ttfb)
+            connections = 1
+        try:
+            while len(samples) < self.settings['latency_samples'] and (should_continue is None or should_continue()):
+                if conn is None:
+                    conn, request = await self._open_through(result.proxy, result.protocol, url, keep_alive=True)
+                    connections += 1
+                response = await conn.request(request, timeout, _FRAMING_WANTED)
+                if response.status != 200:
+                    break
+                samples.append(response.elapsed_ns)
+                
+                length = response.headers.get('content-length', '')
+                reusable = _is_reusable(response.headers)
+                if reusable:
+                    received, _ = await conn.receive_body(int(length), timeout)
+                    # بدنه ناقص یا اضافه یعنی مرز پاسخ بعدی معلوم نیست
+                    reusable = received == int(length) and not conn.is_closed
+                if not reusable:
+                    conn.abort()
+                    conn = None
+        except Exception as e:
+            logger.debug(f"Latency sampling failed for {result.proxy} after {len(samples)} samples: {e}")
+        finally:
+            if conn:
+                conn.abort()
+        return LatencyStats.from_samples(samples, keep_alive=connections == 1 and len(samples) > 1)
+
+    async def _probe_http(self, proxy: str, connect_time: int, session: aiohttp.ClientSession,
+                          conn: ProbeConnection = None) -> ProxyResult:
+        """تست پروکسی HTTP و در صورت نیاز HTTPS"""
+        if self.settings['judge_url']:
+            # خود probe آی‌پی خروجی و anonymity را مشخص می‌کند
+            judged = await self._judge_probe(proxy, session, conn)
+            conn = None
+            if judged:
+                http_time, exit_ip, anonymity = judged
+                return ProxyResult(proxy, connect_time, http_time, ProxyStatus.ACTIVE,
+                                   anonymity=anonymity, exit_ip=exit_ip)
+        
+        if self.settings['probe_policy'] == 'race':
+            http_time, http_success = await self._race_probes(proxy, session, conn)
+            if http_success:
+                return ProxyResult(proxy, connect_time, http_time, ProxyStatus.ACTIVE)
+            return ProxyResult(proxy, connect_time, 9999, ProxyStatus.FAILED)
+        
+        if self.settings['probe_mode'] == 'native':
+            http_time, http_success = await self._test_http_native(proxy, conn)
+        else:
+            http_time, http_success = await self._test_http_proxy(proxy, session)
+        
+        if not http_success and self.settings['test_https']:
+            # تست HTTPS اگر HTTP شکست خورد
+            http_time, http_success = await self._test_https_proxy(proxy, session)
+        
+        if http_success:
+            return ProxyResult(proxy, connect_time, http_time, ProxyStatus.ACTIVE)
+        return ProxyResult(proxy, connect_time, 9999, ProxyStatus.FAILED)
+
+    async def _enrich_result(self, result: ProxyResult, session: aiohttp.ClientSession):
+        """مرحله سوم: تکمیل اطلاعات کشور/ISP/anonymity برای پروکسی سالم"""
+        ip = result.exit_ip or result.proxy.split(':')[0]
+        judged = result.anonymity != AnonymityLevel.UNKNOWN
+        country, country_code, anonymity, isp = await self._detect_proxy_info(ip, session, not judged)
+        result.country, result.country_code, result.isp = country, country_code, isp
+        if not judged:
+            result.anonymity = anonymity
+        await self._finalize_active(result)
+
+    async def _finalize_active(self, result: ProxyResult):
+        """ثبت زمان بررسی و ذخیره سریع پروکسی سالم"""
+        result.last_checked = datetime.now().isoformat()
+        
+        # ذخیره سریع پروکسی سالم - فقط اگر http_time کمتر از 3000 باشد
+        if result.http_time < 3000:
+            await self._save_working_proxy_immediately(result.proxy)
+
+    def _make_geo_provider(self, session: aiohttp.ClientSession):
+        """انتخاب provider جستجوی دسته‌ای کشور/ISP"""
+        provider = self.settings['enrich_provider']
+        if self.geoip and provider in ('geoip', 'auto'):
+            return GeoIPProvider(self.geoip)
+        if provider == 'geoip':
+            logger.warning(f"GeoIP database {self.settings['geoip_db']} not available, "
+                           f"falling back to ip-api.com")
+        return IpApiBatchProvider(session)
+
     async def _test_http_proxy(self, proxy: str, session: aiohttp.ClientSession) -> tuple[int, bool]:
         """تست HTTP proxy"""
         proxies = f'http://{proxy}'
@@ -253,16 +1009,20 @@ class ProxyBackend:
                 
             try:
                 http_start = time.time()
+                marks = {}
                 async with session.get(
                     url, 
                     proxy=proxies,
                     timeout=aiohttp.ClientTimeout(total=self.settings['timeout']),
                     headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
-                    ssl=False
+                    ssl=False,
+                    trace_request_ctx=marks
                 ) as response:
                     if response.status == 200:
+                        _record_aiohttp_phases(marks, False)
                         return int((time.time() - http_start) * 1000), True
-            except:
+            except Exception as e:
+                _note_probe_error(e)
                 continue
         
         return 9999, False
@@ -277,36 +1037,36 @@ class ProxyBackend:
                 
             try:
                 http_start = time.time()
+                marks = {}
                 async with session.get(
                     url, 
                     proxy=proxies,
                     timeout=aiohttp.ClientTimeout(total=self.settings['timeout']),
-                    headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                    headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                    trace_request_ctx=marks
                 ) as response:
                     if response.status == 200:
+                        _record_aiohttp_phases(marks, True)
                         return int((time.time() - http_start) * 1000), True
-            except:
+            except Exception as e:
+                _note_probe_error(e)
                 continue
         
         return 9999, False
 
-    async def _detect_proxy_info(self, ip: str, session: aiohttp.ClientSession) -> tuple[str, str, AnonymityLevel, str]:
+    async def _detect_proxy_info(self, ip: str, session: aiohttp.ClientSession,
+                                 check_anonymity: bool = True) -> tuple[str, str, AnonymityLevel, str]:
         """تشخیص کشور، anonymity و ISP پروکسی"""
         country, country_code, isp = "Unknown", "XX", "Unknown"
         anonymity = AnonymityLevel.UNKNOWN
         
         try:
-            # تشخیص کشور و ISP از ip-api.com
-            async with session.get(
-                f'http://ip-api.com/json/{ip}',
-                timeout=aiohttp.ClientTimeout(total=5)
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('status') == 'success':
-                        country = data.get('country', 'Unknown')
-                        country_code = data.get('countryCode', 'XX')
-                        isp = data.get('isp', 'Unknown')
+            # کشور و ISP بر اساس IP کش می‌شوند - درخواست‌های همزمان یک IP یکی می‌شوند
+            country, country_code, isp = await self.enrich_cache.get_or_fetch(
+                ip, lambda: self._lookup_geo(ip, session))
+            
+            if not check_anonymity:
+                return country, country_code, anonymity, isp
             
             # تست anonymity از httpbin.org
             async with session.get(
@@ -320,17 +1080,41 @@ class ProxyBackend:
                     else:
                         anonymity = AnonymityLevel.ANONYMOUS
                         
-        except:
+        except Exception:
             pass
         
         return country, country_code, anonymity, isp
 
+    async def _lookup_geo(self, ip: str, session: aiohttp.ClientSession) -> tuple[str, str, str]:
+        """جستجوی کشور و ISP - پایگاه داده آفلاین یا ip-api.com"""
+        country, country_code, isp = "Unknown", "XX", "Unknown"
+        
+        record = self.geoip.lookup(ip) if self.geoip else None
+        if record:
+            # جستجوی آفلاین در پایگاه داده بازه‌ها
+            country, country_code, isp = record.geo_info()
+        elif not self.geoip or ip_to_int(ip) is None:
+            # تشخیص کشور و ISP از ip-api.com
+            try:
+                async with session.get(
+                    f'http://ip-api.com/json/{ip}',
+                    timeout=aiohttp.ClientTimeout(total=5)
+                ) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        if data.get('status') == 'success':
+                            country = data.get('country', 'Unknown')
+                            country_code = data.get('countryCode', 'XX')
+                            isp = data.get('isp', 'Unknown')
+            except Exception as e:
+                logger.debug(f"Geo lookup failed for {ip}: {e}")
+        
+        return country, country_code, isp
+
     async def _save_working_proxy_immediately(self, proxy: str):
         """ذخیره فوری پروکسی سالم در فایل"""
         try:
             # استفاده از threading برای جلوگیری از مشکل event loop
-            import threading
-            
             def save_proxy():
                 try:
                     # خواندن فایل فعلی
@@ -360,105 +1144,813 @@ class ProxyBackend:
         except Exception as e:
             logger.error(f"Error in quick save thread: {e}")
         
-    async def run_full_test_async(self, progress_callback: Callable = None, result_callback: Callable = None):
-        """اجرای تست کامل به صورت ناهمزمان"""
+    async def run_full_test_async(self, progress_callback: Callable = None, result_callback: Callable = None,
+                                  update_callback: Callable = None):
+        """اجرای تست کامل به صورت ناهمزمان - پایپ‌لاین سه مرحله‌ای connect → probe → enrich"""
         if self.is_testing:
             return False, {"error": "Test already in progress"}
         
         if not self.proxy_list:
             return False, {"error": "No proxies loaded"}
         
+        self._prepare_stop_signal()
         self.is_testing = True
+        previous_results = self.test_results
         self.test_results = []
         self.best_proxy = None
         
+        # پیش‌فیلتر CDN قبل از هر اتصال
+        self._reset_cdn_filter()
+        proxies = [proxy for proxy in self.proxy_list if self._passes_cdn_filter(proxy)]
+        if self.cdn_skipped:
+            logger.info(f"Skipped {self.cdn_skipped} proxies on CDN ranges")
+        
+        self.incremental_kept = 0
+        if self.settings['incremental']:
+            proxies, kept = self._plan_incremental(proxies, previous_results)
+            self.incremental_kept = len(kept)
+            for result in kept:
+                self.test_results.append(result)
+                self._update_best_proxy(result)
+                if result_callback:
+                    result_callback(result.to_dict())
+            logger.info(f"Incremental scan: {len(kept)} fresh results kept, {len(proxies)} proxies to test")
+            
+            if kept and progress_callback:
+                report_progress = progress_callback
+                
+                def progress_callback(done: int, total: int):
+                    report_progress(len(kept) + done, len(kept) + total)
+        
+        if self.settings['scan_mode'] == 'sharded' and proxies:
+            return await self._run_sharded_test(proxies, progress_callback, result_callback, update_callback)
+        
         try:
-            # ایجاد سمیفور برای محدود کردن concurrent connections
-            semaphore = asyncio.Semaphore(self.settings['max_workers'])
+            if self.settings['scan_mode'] == 'sampling':
+                await self._run_cancellable(
+                    self._run_sampling_test(proxies, progress_callback, result_callback, update_callback))
+            else:
+                await self._run_cancellable(
+                    self._run_pipeline(proxies, len(proxies), progress_callback, result_callback, update_callback))
+            await self._run_cancellable(self._run_bandwidth_phase(update_callback))
+            return self._compile_final_stats()
             
-            async def test_with_semaphore(proxy):
-                async with semaphore:
-                    if not self.is_testing:
-                        return None
-                    
-                    result = await self.test_proxy_async(proxy, session)
-                    
-                    # فرستادن نتیجه به فرانت‌اند
-                    if result_callback:
-                        result_callback(result.to_dict())
-                    
-                    return result
+        except Exception as e:
+            logger.error(f"Async test failed: {e}")
+            return False, {"error": str(e)}
+        finally:
+            self._limiter = None
+            self.is_testing = False
+
+    async def run_topk_test_async(self, k: int = None, max_latency: int = None, budget: float = None,
+                                  progress_callback: Callable = None, result_callback: Callable = None,
+                                  update_callback: Callable = None):
+        """جستجوی سریع: توقف به محض تأیید k پروکسی سالم زیر max_latency (ms) یا پایان budget ثانیه
+        
+        همیشه در حالت pipeline اجرا می‌شود؛ stats شامل top_proxies (مرتب با rank_by) و
+        topk_reason (target، budget، exhausted یا stopped) است.
+        """
+        k = k or self.settings['topk_count']
+        max_latency = max_latency or self.settings['topk_max_latency']
+        budget = budget or self.settings['topk_budget']
+        
+        if self.is_testing:
+            return False, {"error": "Test already in progress"}
+        
+        if not self.proxy_list:
+            return False, {"error": "No proxies loaded"}
+        
+        self._prepare_stop_signal()
+        self.is_testing = True
+        self.test_results = []
+        self.best_proxy = None
+        
+        self._reset_cdn_filter()
+        proxies = [proxy for proxy in self.proxy_list if self._passes_cdn_filter(proxy)]
+        
+        # جدول امتیاز محدود: (کلید rank، پروکسی) مرتب با حداکثر k عضو
+        leaders: List[tuple] = []
+        reason = 'exhausted'
+        started = time.monotonic()
+        
+        def confirm(result: ProxyResult):
+            nonlocal reason
+            if result.status != ProxyStatus.ACTIVE or result.http_time > max_latency:
+                return
+            insort(leaders, (self._rank_key(result), result.proxy))
+            del leaders[k:]
+            if len(leaders) >= k and self.is_testing:
+                reason = 'target'
+                self._signal_stop()
+        
+        def out_of_time():
+            nonlocal reason
+            if self.is_testing:
+                reason = 'budget'
+                self._signal_stop()
+        
+        timer = asyncio.get_running_loop().call_later(budget, out_of_time)
+        try:
+            await self._run_cancellable(
+                self._run_pipeline(proxies, len(proxies), progress_callback, result_callback, update_callback,
+                                   on_publish=confirm))
+            if reason == 'exhausted' and not self.is_testing:
+                reason = 'stopped'
+            if leaders:
+                self.best_proxy = leaders[0][1]
             
-            connector = aiohttp.TCPConnector(limit=self.settings['max_workers'], verify_ssl=False)
+            success, stats = self._compile_final_stats()
+            by_proxy = {r.proxy: r for r in self.test_results}
+            stats['top_proxies'] = [by_proxy[proxy].to_dict() for _, proxy in leaders]
+            stats['topk_reason'] = reason
+            logger.info(f"Top-{k} search finished ({reason}): {len(leaders)} proxies under {max_latency}ms "
+                        f"after {len(self.test_results)} tested in {time.monotonic() - started:.1f}s")
+            return success, stats
             
-            async with aiohttp.ClientSession(connector=connector) as session:
-                tasks = []
-                for proxy in self.proxy_list:
-                    if not self.is_testing:
+        except Exception as e:
+            logger.error(f"Top-k search failed: {e}")
+            return False, {"error": str(e)}
+        finally:
+            timer.cancel()
+            self._limiter = None
+            self.is_testing = False
+
+    async def _run_pipeline(self, proxies: Union[Iterable[str], AsyncIterable[str]], total: Optional[int],
+                            progress_callback: Callable = None, result_callback: Callable = None,
+                            update_callback: Callable = None, on_publish: Callable[[ProxyResult], None] = None):
+        """پایپ‌لاین connect → probe → enrich روی هر iterable از پروکسی‌ها"""
+        # هر مرحله استخر و صف مخصوص به خود را دارد
+        connect_workers = self.settings['connect_workers']
+        probe_workers = self.settings['max_workers']
+        enrich_workers = self.settings['enrich_workers']
+        
+        reuse_connection = self.settings['probe_mode'] == 'native'
+        
+        # در حالت adaptive یک limit مشترک تعداد connect و probe های همزمان را در زمان اجرا تعیین می‌کند
+        limiter = None
+        self.concurrency_history = []
+        if self.settings['concurrency_mode'] == 'adaptive':
+            limiter = AdaptiveLimiter(
+                initial=connect_workers,
+                minimum=self.settings['adaptive_min'],
+                maximum=self.settings['adaptive_max']
+            )
+            connect_workers = probe_workers = limiter.maximum
+        self._limiter = limiter
+        
+        probe_queue = asyncio.Queue(maxsize=probe_workers * 2)
+        enrich_queue = asyncio.Queue(maxsize=enrich_workers * 2)
+        
+        governor = None
+        self.resource_throttles = 0
+        if self.settings['resource_governor']:
+            governor = ResourceGovernor(
+                max_sockets=self.settings['governor_max_sockets'],
+                max_time_wait=self.settings['governor_max_time_wait'],
+                max_rss_mb=self.settings['governor_max_rss_mb'],
+                max_wait=self.settings['governor_max_wait']
+            )
+        
+        proxy_iter = proxies if hasattr(proxies, '__aiter__') else iter(proxies)
+        completed = 0
+        started = time.monotonic()
+        self.time_to_first_active = None
+        
+        def publish(result: ProxyResult):
+            nonlocal completed
+            if not result.last_checked:
+                result.last_checked = datetime.now().isoformat()
+            self.test_results.append(result)
+            completed += 1
+            self._update_best_proxy(result)
+            
+            if result.status == ProxyStatus.ACTIVE and self.time_to_first_active is None:
+                self.time_to_first_active = int((time.monotonic() - started) * 1000)
+                logger.info(f"First working proxy after {self.time_to_first_active}ms: {result.proxy}")
+            
+            # فرستادن نتیجه و پیشرفت به فرانت‌اند
+            if result_callback:
+                result_callback(result.to_dict())
+            if progress_callback:
+                # در حالت stream پروکسی‌های رد شده روی CDN هرگز منتشر نمی‌شوند و در total حساب نمی‌شوند
+                queued = total or max(completed, len(self.proxy_list) - self.cdn_skipped)
+                progress_callback(completed, queued)
+            if on_publish:
+                on_publish(result)
+        
+        async def open_governed(proxy: str) -> Optional[ProbeConnection]:
+            # خطای منابع محلی باعث تکرار می‌شود نه علامت‌گذاری FAILED
+            for attempt in range(3):
+                if governor:
+                    await governor.wait_ready()
+                try:
+                    async with limiter or nullcontext():
+                        return await self._open_tcp(proxy)
+                except OSError as e:
+                    if e.errno not in LOCAL_RESOURCE_ERRNOS or attempt == 2:
+                        raise
+                    logger.debug(f"Local resource error for {proxy}, retrying: {e}")
+                    await asyncio.sleep(0.5 * (attempt + 1))
+        
+        async def connect_one(proxy: str):
+            # مرحله ارزان و عریض: فقط بررسی باز بودن پورت
+            try:
+                conn = await open_governed(proxy)
+            except Exception as e:
+                logger.debug(f"Error testing proxy {proxy}: {e}")
+                publish(ProxyResult(proxy, 9999, 9999, ProxyStatus.ERROR))
+                return
+            if conn is None:
+                publish(ProxyResult(proxy, 9999, 9999, ProxyStatus.FAILED))
+                return
+            if not reuse_connection:
+                conn.close()
+            await probe_queue.put((proxy, conn.connect_ms, conn if reuse_connection else None,
+                                   {'dns': conn.dns_ns, 'tcp': conn.connect_ns}))
+        
+        async def take_chunk(size: int) -> List[str]:
+            if not hasattr(proxy_iter, '__anext__'):
+                return list(islice(proxy_iter, size))
+            chunk = []
+            async for proxy in proxy_iter:
+                chunk.append(proxy)
+                if len(chunk) >= size:
+                    break
+            return chunk
+        
+        async def sweep_stage():
+            # مرحله اول با sweeper انبوه در یک thread جداگانه
+            sweeper = TCPSweeper(self.settings['sweep_inflight'], timeout=5)
+            loop = asyncio.get_running_loop()
+            while self.is_testing:
+                # sweeper خودش inflight را محدود می‌کند؛ governor بین chunk ها اعمال می‌شود
+                if governor:
+                    await governor.wait_ready()
+                chunk = await take_chunk(self.settings['sweep_chunk'])
+                if not chunk:
+                    break
+                chunk, targets = await self._resolve_sweep_targets(chunk, publish)
+                # خطای منابع محلی باعث تکرار می‌شود نه علامت‌گذاری FAILED (مثل open_governed)
+                for attempt in range(3):
+                    sweep = await loop.run_in_executor(None, sweeper.sweep, targets, lambda: self.is_testing)
+                    local = set(sweep.local_errors)
+                    last_attempt = attempt == 2 or not self.is_testing
+                    for index, proxy in enumerate(chunk):
+                        if sweep.is_alive(index):
+                            await probe_queue.put((proxy, sweep.rtt_ms(index), None, {'tcp': sweep.rtt_ns[index]}))
+                        elif index not in local:
+                            publish(ProxyResult(proxy, 9999, 9999, ProxyStatus.FAILED))
+                        elif last_attempt:
+                            publish(ProxyResult(proxy, 9999, 9999, ProxyStatus.ERROR))
+                    if not local or last_attempt:
                         break
-                    task = asyncio.create_task(test_with_semaphore(proxy))
-                    tasks.append(task)
-                
-                completed = 0
-                total = len(tasks)
+                    logger.debug(f"Local resource errors for {len(local)} sweep targets, retrying")
+                    chunk = [chunk[index] for index in sorted(local)]
+                    targets = [targets[index] for index in sorted(local)]
+                    await asyncio.sleep(0.5 * (attempt + 1))
+                    if governor:
+                        await governor.wait_ready()
+        
+        async def probe_stage():
+            while True:
+                item = await probe_queue.get()
+                if item is None:
+                    break
+                proxy, connect_time, conn, phases = item
+                if not self.is_testing:
+                    # تخلیه صف تا مرحله قبل بلاک نشود
+                    if conn:
+                        conn.close()
+                    continue
+                try:
+                    async with limiter or nullcontext():
+                        result = await self._probe_proxy(proxy, connect_time, session, conn, phases,
+                                                         lambda: self.is_testing)
+                except Exception as e:
+                    logger.debug(f"Error testing proxy {proxy}: {e}")
+                    result = ProxyResult(proxy, 9999, 9999, ProxyStatus.ERROR)
+                if result.status != ProxyStatus.ACTIVE:
+                    publish(result)
+                elif enricher:
+                    await publish_deferred(result)
+                else:
+                    await enrich_queue.put(result)
+        
+        async def publish_deferred(result: ProxyResult):
+            # انتشار فوری با اطلاعات موقت - کشور/ISP بعداً به صورت دسته‌ای
+            await self._finalize_active(result)
+            publish(result)
+            ip = result.exit_ip or result.proxy.split(':')[0]
+            waiting = pending_geo.setdefault(ip, [])
+            waiting.append(result)
+            if len(waiting) == 1:
+                enricher.submit(ip)
+        
+        def apply_geo(ip: str, geo: tuple):
+            # آپدیت درجا در test_results و ارسال رویداد به فرانت‌اند
+            for result in pending_geo.pop(ip, []):
+                result.country, result.country_code, result.isp = geo
+                if update_callback:
+                    update_callback(result.to_dict())
+        
+        async def enrich_stage():
+            while True:
+                result = await enrich_queue.get()
+                if result is None:
+                    break
+                if not self.is_testing:
+                    continue
+                try:
+                    await self._enrich_result(result, session)
+                except Exception as e:
+                    logger.debug(f"Error enriching proxy {result.proxy}: {e}")
+                publish(result)
+        
+        connector = aiohttp.TCPConnector(limit=probe_workers + enrich_workers, verify_ssl=False,
+                                         resolver=CachedResolver(self.dns), use_dns_cache=False)
+        
+        async with aiohttp.ClientSession(connector=connector, trace_configs=[_phase_trace_config()]) as session:
+            if self.settings['judge_url']:
+                await self._load_real_ip(session)
+            
+            enricher = None
+            pending_geo = {}
+            if self.settings['enrich_mode'] == 'deferred':
+                enricher = BatchEnricher(self._make_geo_provider(session), self.enrich_cache, apply_geo,
+                                         batch_size=self.settings['enrich_batch_size'])
+                enrich_tasks = [asyncio.create_task(enricher.run())]
+            else:
+                enrich_tasks = [asyncio.create_task(enrich_stage()) for _ in range(enrich_workers)]
+            probe_tasks = [asyncio.create_task(probe_stage()) for _ in range(probe_workers)]
+            if self.settings['connect_mode'] == 'sweep':
+                connect_task = asyncio.create_task(sweep_stage())
+            else:
+                connect_task = asyncio.create_task(
+                    run_worker_pool(proxy_iter, connect_one, connect_workers, lambda: self.is_testing))
+            
+            controller_task = asyncio.create_task(limiter.run()) if limiter else None
+            governor_task = asyncio.create_task(governor.run()) if governor else None
+            stage_tasks = [connect_task, *probe_tasks, *enrich_tasks,
+                           *(task for task in (controller_task, governor_task) if task)]
+            
+            try:
+                # بستن مرحله به مرحله: پایان هر مرحله با ارسال sentinel به مرحله بعد
+                await connect_task
+                if controller_task:
+                    controller_task.cancel()
+                    self.concurrency_history = limiter.history
+                    logger.info(f"Adaptive concurrency finished at {limiter.limit} "
+                                f"({len(limiter.history)} adjustments recorded)")
+                if governor_task:
+                    governor_task.cancel()
+                    self.resource_throttles = governor.throttle_count
+                for _ in probe_tasks:
+                    await probe_queue.put(None)
+                await asyncio.gather(*probe_tasks)
+                if enricher:
+                    if self.is_testing:
+                        enricher.close()
+                    else:
+                        enrich_tasks[0].cancel()
+                    await asyncio.gather(*enrich_tasks, return_exceptions=True)
+                else:
+                    for _ in enrich_tasks:
+                        await enrich_queue.put(None)
+                    await asyncio.gather(*enrich_tasks)
+            finally:
+                # در لغو (Stop) همه مراحل با هم لغو می‌شوند؛ probe ها اتصال‌هایشان را در finally می‌بندند
+                pending = [task for task in stage_tasks if not task.done()]
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.wait(pending, timeout=self.settings['stop_deadline'])
+                # اتصال‌های مرحله TCP که هنوز در صف probe مانده‌اند
+                while not probe_queue.empty():
+                    item = probe_queue.get_nowait()
+                    if item and item[2]:
+                        item[2].abort()
                 
-                for future in asyncio.as_completed(tasks):
-                    if not self.is_testing:
-                        # لغو تسک‌های باقی‌مانده به درستی
-                        for task in tasks:
-                            if not task.done():
-                                task.cancel()
-                        try:
-                            await asyncio.gather(*tasks, return_exceptions=True)
-                        except:
-                            pass
+                cache_stats = self.enrich_cache.stats()
+                logger.info(f"Enrichment cache: {cache_stats['hit_rate']:.1f}% hit rate, "
+                            f"{cache_stats['size']} entries")
+                self.enrich_cache.save()
+
+    def _plan_incremental(self, proxies: List[str],
+                          previous_results: List[ProxyResult]) -> tuple[List[str], List[ProxyResult]]:
+        """(پروکسی‌های قابل تست، نتایج تازه نگه‌داشته) - جدیدها اول، بعد قدیمی‌ترین نتایج
+        
+        TTL بر اساس وضعیت: rescan_ttl_active برای Active/Error، rescan_ttl_failed برای Failed؛
+        نتیجه بدون last_checked (مثلاً Skipped) همیشه کهنه است.
+        """
+        previous = {r.proxy: r for r in previous_results}
+        now = datetime.now()
+        kept, new, stale = [], [], []
+        for proxy in proxies:
+            result = previous.get(proxy)
+            if result is None:
+                new.append(proxy)
+                continue
+            try:
+                age = (now - datetime.fromisoformat(result.last_checked)).total_seconds()
+            except (TypeError, ValueError):
+                age = float('inf')
+            ttl = self.settings['rescan_ttl_failed'] if result.status == ProxyStatus.FAILED \
+                else self.settings['rescan_ttl_active']
+            if result.status != ProxyStatus.SKIPPED and age < ttl:
+                kept.append(result)
+            else:
+                stale.append((-age, proxy))
+        stale.sort()
+        return new + [proxy for _, proxy in stale], kept
+
+    def _group_by_subnet(self, proxies: List[str]) -> Dict[Any, List[str]]:
+        """گروه‌بندی پروکسی‌ها بر اساس prefix آدرس - هر hostname گروه خودش را دارد"""
+        shift = 32 - max(0, min(32, self.settings['sampling_prefix']))
+        groups: Dict[Any, List[str]] = {}
+        for proxy in proxies:
+            host = proxy.rsplit(':', 1)[0]
+            number = ip_to_int(host)
+            key = host if number is None else number >> shift
+            groups.setdefault(key, []).append(proxy)
+        return groups
+
+    async def _run_sampling_test(self, proxies: List[str], progress_callback: Callable = None,
+                                 result_callback: Callable = None, update_callback: Callable = None):
+        """تست نمونه‌ای از هر subnet و گسترش فقط به گروه‌هایی که نمونه‌هایشان زنده بودند"""
+        sample_size = max(1, self.settings['sampling_size'])
+        min_group = max(sample_size, self.settings['sampling_min_group'])
+        
+        # مرحله اول: نمونه‌ها + گروه‌های کوچک به صورت کامل
+        first_pass: List[str] = []
+        remaining: Dict[Any, List[str]] = {}
+        sampled_group: Dict[str, Any] = {}
+        for key, group in self._group_by_subnet(proxies).items():
+            if len(group) <= min_group:
+                first_pass.extend(group)
+                continue
+            random.shuffle(group)
+            first_pass.extend(group[:sample_size])
+            remaining[key] = group[sample_size:]
+            for proxy in group[:sample_size]:
+                sampled_group[proxy] = key
+        
+        planned = len(proxies)
+        offset = 0
+        
+        def report(done: int, _total: int):
+            if progress_callback:
+                progress_callback(offset + done, planned)
+        
+        logger.info(f"Sampling {len(first_pass)} of {len(proxies)} proxies from {len(remaining)} large groups")
+        await self._run_pipeline(first_pass, len(first_pass), report, result_callback, update_callback)
+        first_active = self.time_to_first_active
+        
+        # نرخ موفقیت هر گروه از روی نمونه‌ها
+        hits: Dict[Any, int] = {}
+        for result in self.test_results:
+            key = sampled_group.get(result.proxy)
+            if key is not None and result.status == ProxyStatus.ACTIVE:
+                hits[key] = hits.get(key, 0) + 1
+        
+        expand: List[str] = []
+        threshold = self.settings['sampling_hit_rate']
+        for key, rest in remaining.items():
+            if hits.get(key, 0) / sample_size > threshold:
+                expand.extend(rest)
+            else:
+                # بدون اتصال - فقط برای گزارش و export ثبت می‌شوند
+                self.test_results.extend(ProxyResult(proxy, 9999, 9999, ProxyStatus.SKIPPED) for proxy in rest)
+        
+        offset = len(first_pass)
+        planned = offset + len(expand)
+        logger.info(f"Expanding {len(expand)} proxies, {len(proxies) - planned} skipped by inference")
+        if expand and self.is_testing:
+            await self._run_pipeline(expand, len(expand), report, result_callback, update_callback)
+        if first_active is not None:
+            self.time_to_first_active = first_active
+        if progress_callback:
+            progress_callback(planned, planned)
+
+    async def _resolve_sweep_targets(self, chunk: List[str], publish: Callable) -> tuple[List[str], list]:
+        """(پروکسی‌ها، (آی‌پی، پورت)) برای sweeper - hostname ها همزمان resolve می‌شوند
+        
+        sweeper در thread جداگانه است و connect_ex با hostname بلاک می‌شود؛
+        نام‌هایی که resolve نشوند همین‌جا FAILED ثبت می‌شوند.
+        """
+        targets = [tuple(proxy.rsplit(':', 1)) for proxy in chunk]
+        named = [index for index, (host, _) in enumerate(targets) if ip_to_int(host) is None]
+        if not named:
+            return chunk, targets
+        
+        resolved = await asyncio.gather(*(self.dns.resolve(targets[index][0]) for index in named),
+                                        return_exceptions=True)
+        failed = set()
+        for index, addresses in zip(named, resolved):
+            if isinstance(addresses, BaseException):
+                failed.add(index)
+                publish(ProxyResult(chunk[index], 9999, 9999, ProxyStatus.FAILED))
+            else:
+                targets[index] = (addresses[0], targets[index][1])
+        keep = [index for index in range(len(chunk)) if index not in failed]
+        return [chunk[index] for index in keep], [targets[index] for index in keep]
+
+    async def run_stream_test_async(self, filename: str, progress_callback: Callable = None,
+                                    result_callback: Callable = None, update_callback: Callable = None):
+        """تست همزمان با پارس فایل - اولین پروکسی‌ها قبل از پایان خواندن فایل تست می‌شوند"""
+        if self.is_testing:
+            return False, {"error": "Test already in progress"}
+        
+        if not os.path.exists(filename):
+            return False, {"error": f"File not found: {filename}"}
+        
+        self._prepare_stop_signal()
+        self.is_testing = True
+        self.test_results = []
+        self.best_proxy = None
+        self.proxy_list = []
+        
+        stream_queue = asyncio.Queue(maxsize=self.settings['stream_queue_size'])
+        producer = asyncio.create_task(self._stream_proxies_from_file(filename, stream_queue))
+        
+        self._reset_cdn_filter()
+        
+        async def consume():
+            while True:
+                proxy = await stream_queue.get()
+                if proxy is None:
+                    return
+                if self._passes_cdn_filter(proxy):
+                    yield proxy
+        
+        try:
+            # total نامعلوم است - پیشرفت بر اساس تعداد پارس و صف شده تا این لحظه
+            await self._run_cancellable(
+                self._run_pipeline(consume(), None, progress_callback, result_callback, update_callback))
+            if producer.done() and not producer.cancelled() and producer.exception():
+                raise producer.exception()
+            logger.info(f"Streamed {len(self.proxy_list)} unique proxies from {filename}")
+            await self._run_cancellable(self._run_bandwidth_phase(update_callback))
+            return self._compile_final_stats()
+            
+        except Exception as e:
+            logger.error(f"Stream test failed: {e}")
+            return False, {"error": str(e)}
+        finally:
+            producer.cancel()
+            self._limiter = None
+            self.is_testing = False
+
+    async def _run_sharded_test(self, proxies: List[str], progress_callback: Callable = None,
+                                result_callback: Callable = None, update_callback: Callable = None):
+        """تقسیم پروکسی‌ها بین چند پروسس - هر پروسس event loop و session خودش را دارد"""
+        processes = []
+        try:
+            shard_count = self.settings['shard_processes'] or os.cpu_count() or 1
+            shard_count = max(1, min(shard_count, len(proxies)))
+            shards = [proxies[i::shard_count] for i in range(shard_count)]
+            
+            # پروسس‌های فرزند حالت pipeline را اجرا می‌کنند
+            shard_settings = dict(self.settings, scan_mode='pipeline')
+            ctx = multiprocessing.get_context('spawn')
+            result_queue = ctx.Queue()
+            stop_event = ctx.Event()
+            
+            for shard_id, shard in enumerate(shards):
+                process = ctx.Process(
+                    target=_shard_worker,
+                    args=(shard_id, shard, shard_settings, result_queue, stop_event),
+                    daemon=True
+                )
+                process.start()
+                processes.append(process)
+            
+            logger.info(f"Sharded scan started with {shard_count} processes")
+            
+            loop = asyncio.get_running_loop()
+            total = len(proxies)
+            completed = 0
+            running = shard_count
+            results_by_proxy = {}
+            stop_deadline = None
+            
+            while running:
+                if not self.is_testing:
+                    stop_event.set()
+                    # فرزندها خودشان لغو می‌شوند؛ بعد از stop_deadline منتظر پیام‌هایشان نمی‌مانیم
+                    if stop_deadline is None:
+                        stop_deadline = self._stop_time + self.settings['stop_deadline']
+                    if time.monotonic() >= stop_deadline:
                         break
-                    
-                    try:
-                        result = await future
+                try:
+                    message = await loop.run_in_executor(None, result_queue.get, True, 0.05)
+                except queue.Empty:
+                    if not any(p.is_alive() for p in processes):
+                        logger.error("Shard processes exited unexpectedly")
+                        break
+                    continue
+                
+                kind, payload = message
+                if kind == 'done':
+                    running -= 1
+                    continue
+                
+                if kind == 'cache':
+                    # فقط پروسس والد کش را روی دیسک می‌نویسد
+                    self.enrich_cache.merge(payload)
+                    continue
+                
+                if kind == 'updates':
+                    # enrichment تأخیری در پروسس فرزند
+                    for data in payload:
+                        result = results_by_proxy.get(data['proxy'])
                         if result:
-                            self.test_results.append(result)
-                            completed += 1
-                            
-                            # آپدیت بهترین پروکسی
-                            if result.status == ProxyStatus.ACTIVE:
-                                if not self.best_proxy:
-                                    self.best_proxy = result.proxy
-                                else:
-                                    current_best = next((r for r in self.test_results if r.proxy == self.best_proxy), None)
-                                    if current_best:
-                                        if result.http_time < current_best.http_time:
-                                            self.best_proxy = result.proxy
-                                        elif result.http_time == current_best.http_time and result.ping < current_best.ping:
-                                            self.best_proxy = result.proxy
-                            
-                            # فرستادن پیشرفت به فرانت‌اند
-                            if progress_callback:
-                                progress_callback(completed, total)
-                                
-                    except Exception as e:
-                        logger.debug(f"Error in async test: {e}")
-                        completed += 1
-                        if progress_callback:
-                            progress_callback(completed, total)
+                            result.country, result.country_code, result.isp = \
+                                data['country'], data['country_code'], data['isp']
+                        if update_callback:
+                            update_callback(data)
+                    continue
+                
+                # payload: دسته‌ای از دیکشنری‌های to_dict
+                for data in payload:
+                    result = ProxyResult.from_dict(data)
+                    results_by_proxy[result.proxy] = result
+                    self.test_results.append(result)
+                    completed += 1
+                    self._update_best_proxy(result)
+                    
+                    if result_callback:
+                        result_callback(data)
+                    if progress_callback:
+                        progress_callback(completed, total)
             
+            # پروسس‌های فرزند مرحله دوم ندارند - تست پهنای باند فقط اینجا و با همزمانی محدود
+            await self._run_cancellable(self._run_bandwidth_phase(update_callback))
             return self._compile_final_stats()
             
         except Exception as e:
-            logger.error(f"Async test failed: {e}")
+            logger.error(f"Sharded test failed: {e}")
             return False, {"error": str(e)}
         finally:
+            for process in processes:
+                if not self.is_testing:
+                    # Stop: سیستم‌عامل سوکت‌های پروسس‌های باقی‌مانده را می‌بندد
+                    process.terminate()
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self.enrich_cache.save()
             self.is_testing = False
+
+    def _bandwidth_target(self) -> Optional[str]:
+        """آدرس payload با حجم تنظیم شده - None اگر سروری تنظیم نشده"""
+        url = self.settings['bandwidth_url']
+        if not url and self.settings['judge_url']:
+            url = urljoin(self.settings['judge_url'], '/payload')
+        if not url:
+            return None
+        separator = '&' if '?' in url else '?'
+        return f"{url}{separator}size={self.settings['bandwidth_bytes']}"
+
+    async def _measure_bandwidth(self, result: ProxyResult, url: str) -> int:
+        """سرعت دانلود پایدار (KB/s) از payload سرور خودمان - بایت‌ها نگه‌داری نمی‌شوند، 0 در صورت خطا"""
+        conn = None
+        try:
+            conn, request = await self._open_through(result.proxy, result.protocol, url)
+            response = await conn.request(request, self.settings['timeout'])
+            if response.status != 200:
+                logger.debug(f"Bandwidth test for {result.proxy} got status {response.status}")
+                return 0
+            # زمان از رسیدن هدرها اندازه گرفته می‌شود تا تأخیر اتصال در سرعت حساب نشود
+            received, elapsed_ns = await conn.receive_body(self.settings['bandwidth_bytes'],
+                                                           self.settings['bandwidth_duration'])
+        except Exception as e:
+            logger.debug(f"Bandwidth test failed for {result.proxy}: {e}")
+            return 0
+        finally:
+            if conn:
+                conn.abort()
+        
+        # بدنه خیلی کوتاه (مثلاً صفحه تزریقی پروکسی) قابل اندازه‌گیری نیست
+        if received < min(self.settings['bandwidth_bytes'], 65536) or elapsed_ns <= 0:
+            logger.debug(f"Bandwidth test for {result.proxy} received only {received} bytes")
+            return 0
+        return max(1, int(received * 1_000_000_000 / elapsed_ns / 1024))
+
+    async def _run_bandwidth_phase(self, update_callback: Callable = None):
+        """مرحله دوم اختیاری: تست پهنای باند top-N پروکسی سالم و انتخاب مجدد بهترین پروکسی"""
+        if not self.settings['bandwidth_test'] or not self.is_testing:
+            return
+        url = self._bandwidth_target()
+        if not url:
+            logger.warning("Bandwidth test skipped: no bandwidth_url or judge_url configured")
+            return
         
+        active = [r for r in self.test_results if r.status == ProxyStatus.ACTIVE]
+        candidates = sorted(active, key=self._rank_key)[:self.settings['bandwidth_top_n']]
+        if not candidates:
+            return
+        logger.info(f"Bandwidth test for top {len(candidates)} proxies")
+        
+        async def measure(result: ProxyResult):
+            result.bandwidth = await self._measure_bandwidth(result, url)
+            logger.info(f"Bandwidth {result.proxy}: {result.bandwidth} KB/s")
+            if update_callback:
+                update_callback(result.to_dict())
+        
+        await run_worker_pool(candidates, measure, max(1, self.settings['bandwidth_concurrency']),
+                              lambda: self.is_testing)
+        
+        # پهنای باند فقط پروکسی کم‌ظرفیت را کنار می‌گذارد؛ بین بقیه ترتیب rank_by حفظ می‌شود
+        fast_enough = [r for r in candidates if r.bandwidth >= self.settings['bandwidth_min_kbps']]
+        if fast_enough:
+            best = fast_enough[0]
+            self.best_proxy = best.proxy
+            logger.info(f"Best proxy after bandwidth check: {best.proxy} ({best.bandwidth} KB/s)")
+        else:
+            logger.warning(f"No proxy reached {self.settings['bandwidth_min_kbps']} KB/s")
+
+    def _rank_key(self, result: ProxyResult) -> tuple:
+        """کلید مقایسه پروکسی‌های سالم بر اساس rank_by - کوچک‌تر بهتر
+
+        با p50/p95 پروکسی‌های بدون نمونه بعد از نمونه‌برداری شده‌ها قرار می‌گیرند و
+        jitter تساوی را می‌شکند.
+        """
+        metric = self.settings['rank_by']
+        if metric in ('p50', 'p95'):
+            latency = result.latency
+            if not latency.samples:
+                return (1, result.http_time, 0, result.ping)
+            return (0, getattr(latency, metric), latency.jitter, result.ping)
+        return (0, result.http_time, 0, result.ping)
+
+    def _update_best_proxy(self, result: ProxyResult):
+        """آپدیت بهترین پروکسی با نتیجه جدید"""
+        if result.status != ProxyStatus.ACTIVE:
+            return
+        if not self.best_proxy:
+            self.best_proxy = result.proxy
+            return
+        current_best = next((r for r in self.test_results if r.proxy == self.best_proxy), None)
+        if current_best and self._rank_key(result) < self._rank_key(current_best):
+            self.best_proxy = result.proxy
+        
+    def _prepare_stop_signal(self):
+        """ساخت event توقف روی حلقه اسکن جاری"""
+        self._scan_loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+
+    async def _run_cancellable(self, coro):
+        """اجرای یک مرحله اسکن تا پایان یا Stop
+        
+        با stop_testing تسک مرحله لغو می‌شود (لغو تا probe های در جریان می‌رسد) و حداکثر
+        stop_deadline ثانیه برای بسته شدن آن‌ها صبر می‌شود؛ نتایج منتشر شده تا آن لحظه می‌مانند.
+        """
+        task = asyncio.create_task(coro)
+        stopped = asyncio.create_task(self._stop_event.wait())
+        try:
+            await asyncio.wait((task, stopped), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            stopped.cancel()
+        
+        if not task.done():
+            stop_start = time.perf_counter()
+            task.cancel()
+            done, _ = await asyncio.wait((task,), timeout=self.settings['stop_deadline'])
+            elapsed = int((time.perf_counter() - stop_start) * 1000)
+            if done:
+                logger.info(f"Scan cancelled in {elapsed}ms")
+            else:
+                logger.warning(f"Scan did not finish cancelling within {elapsed}ms")
+                return None
+        if task.cancelled():
+            return None
+        return task.result()
+
+    def _signal_stop(self):
+        """پایان اسکن جاری از هر thread - probe های در جریان لغو و اتصال‌هایشان بسته می‌شوند"""
+        self.is_testing = False
+        self._stop_time = time.monotonic()
+        loop, stop_event = self._scan_loop, self._stop_event
+        if loop is not None and stop_event is not None:
+            try:
+                loop.call_soon_threadsafe(stop_event.set)
+            except RuntimeError:
+                # حلقه اسکن قبلاً بسته شده است
+                pass
+
     def stop_testing(self):
         """توقف کامل تست"""
-        self.is_testing = False
+        self._signal_stop()
         logger.info("Test stopped by user")
 
     def _compile_final_stats(self) -> tuple[bool, dict]:
         """کامپایل آمار نهایی"""
-        active_results = [r for r in self.test_results if r.status == ProxyStatus.ACTIVE]
-        failed_results = [r for r in self.test_results if r.status != ProxyStatus.ACTIVE]
+        tested_results = [r for r in self.test_results if r.status != ProxyStatus.SKIPPED]
+        active_results = [r for r in tested_results if r.status == ProxyStatus.ACTIVE]
+        failed_results = [r for r in tested_results if r.status != ProxyStatus.ACTIVE]
         
         active_pings = [r.ping for r in active_results]
         active_http_times = [r.http_time for r in active_results]
@@ -470,7 +1962,7 @@ class ProxyBackend:
         
         stats = {
             'total': len(self.proxy_list),
-            'tested': len(self.test_results),
+            'tested': len(tested_results),
             'active': len(active_results),
             'failed': len(failed_results),
             'best_ping': best_ping,
@@ -478,9 +1970,31 @@ class ProxyBackend:
             'best_http_time': best_http_time,
             'avg_http_time': avg_http_time,
             'best_proxy': self.best_proxy,
-            'success_rate': (len(active_results) / len(self.test_results) * 100) if self.test_results else 0
+            'success_rate': (len(active_results) / len(tested_results) * 100) if tested_results else 0
         }
         
+        inferred = len(self.test_results) - len(tested_results)
+        if inferred:
+            stats['inferred_skipped'] = inferred
+        if self.cdn_skipped:
+            stats['cdn_skipped'] = self.cdn_skipped
+        if self.incremental_kept:
+            stats['incremental_kept'] = self.incremental_kept
+        if self.concurrency_history:
+            stats['concurrency_history'] = self.concurrency_history
+        if self.resource_throttles:
+            stats['resource_throttles'] = self.resource_throttles
+        if self.time_to_first_active is not None:
+            stats['time_to_first_active'] = self.time_to_first_active
+        bandwidths = [r.bandwidth for r in active_results if r.bandwidth]
+        if bandwidths:
+            stats['bandwidth_tested'] = len(bandwidths)
+            stats['best_bandwidth'] = max(bandwidths)
+        if self.dns.misses:
+            stats['dns_cache'] = self.dns.stats()
+        if self.enrich_cache.hits or self.enrich_cache.misses:
+            stats['enrich_cache'] = self.enrich_cache.stats()
+        
         return True, stats
 
     def get_stats(self) -> dict:
@@ -488,15 +2002,16 @@ class ProxyBackend:
         if not self.test_results:
             return {}
         
-        active_results = [r for r in self.test_results if r.status == ProxyStatus.ACTIVE]
-        success_rate = (len(active_results) / len(self.test_results) * 100) if self.test_results else 0
+        tested_results = [r for r in self.test_results if r.status != ProxyStatus.SKIPPED]
+        active_results = [r for r in tested_results if r.status == ProxyStatus.ACTIVE]
+        success_rate = (len(active_results) / len(tested_results) * 100) if tested_results else 0
         
         active_http_times = [r.http_time for r in active_results]
         best_http_time = min(active_http_times) if active_http_times else 0
         
         return {
             'total_proxies': len(self.proxy_list),
-            'tested_proxies': len(self.test_results),
+            'tested_proxies': len(tested_results),
             'active_proxies': len(active_results),
             'success_rate': success_rate,
             'best_proxy': self.best_proxy,
@@ -618,6 +2133,23 @@ class ProxyBackend:
             sorted_results = sorted(self.test_results, key=lambda x: x.proxy)
         elif sort_by == 'country':
             sorted_results = sorted(self.test_results, key=lambda x: x.country)
+        elif sort_by == 'bandwidth':
+            sorted_results = sorted(self.test_results, key=lambda x: -x.bandwidth)
+        elif sort_by == 'rank':
+            # سالم‌ها با معیار rank_by، بقیه در انتها
+            sorted_results = sorted(self.test_results,
+                                    key=lambda x: (x.status != ProxyStatus.ACTIVE, self._rank_key(x)))
+        elif sort_by in ('p50', 'p95', 'jitter'):
+            def latency_key(result):
+                value = getattr(result.latency, sort_by)
+                return (value is None, value or 0)
+            sorted_results = sorted(self.test_results, key=latency_key)
+        elif sort_by in PhaseTimings._fields:
+            # مرحله اندازه‌گیری نشده در انتها
+            def phase_key(result):
+                value = getattr(result.timings, sort_by)
+                return (value is None, value or 0)
+            sorted_results = sorted(self.test_results, key=phase_key)
         else:
             sorted_results = self.test_results
         
@@ -724,11 +2256,26 @@ class ProxyBackend:
             return "Unknown"
 
     def auto_set_best_proxy(self) -> tuple[bool, str]:
-        """تنظیم اتوماتیک بهترین پروکسی"""
+        """تنظیم اتوماتیک بهترین پروکسی - بدون نتیجه قبلی فراخواننده باید جستجوی سریع top-k را اجرا کند"""
         if not self.best_proxy:
             return False, "No best proxy available"
         return self.set_windows_proxy(self.best_proxy)
 
+    def auto_set_best_proxy_blocking(self) -> tuple[bool, str]:
+        """مثل auto_set_best_proxy ولی بدون نتیجه قبلی جستجوی سریع top-k را روی حلقه جدید اجرا می‌کند
+
+        تا topk_budget ثانیه بلاک می‌کند - از UI thread صدا زده نشود.
+        """
+        if not self.best_proxy and self.proxy_list and not self.is_testing:
+            try:
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(self.run_topk_test_async())
+                loop.close()
+            except Exception as e:
+                logger.error(f"Quick search failed: {e}")
+        return self.auto_set_best_proxy()
+
     def clear_all(self):
         """پاک کردن همه داده‌ها"""
         self.proxy_list.clear()
@@ -740,14 +2287,24 @@ class ProxyBackend:
     def update_settings(self, new_settings: dict):
         """آپدیت تنظیمات"""
         self.settings.update(new_settings)
+        if 'geoip_db' in new_settings:
+            if self.geoip:
+                self.geoip.close()
+            self.geoip = open_geoip_db(self.settings['geoip_db'])
+        self.dns.min_ttl = self.settings['dns_min_ttl']
+        self.dns.max_ttl = self.settings['dns_max_ttl']
+        self.dns.negative_ttl = self.settings['dns_negative_ttl']
+        if 'cdn_ranges_file' in new_settings:
+            self.cdn_ranges = self._load_cdn_ranges()
         self.save_settings()
         logger.info("Settings updated")
 
     def test_single_proxy(self, proxy: str) -> ProxyResult:
         """تست یک پروکسی خاص"""
         async def run_single_test():
-            connector = aiohttp.TCPConnector(verify_ssl=False)
-            async with aiohttp.ClientSession(connector=connector) as session:
+            connector = aiohttp.TCPConnector(verify_ssl=False, resolver=CachedResolver(self.dns),
+                                             use_dns_cache=False)
+            async with aiohttp.ClientSession(connector=connector, trace_configs=[_phase_trace_config()]) as session:
                 return await self.test_proxy_async(proxy, session)
         
         try:
@@ -782,38 +2339,120 @@ class ProxyBackend:
         except Exception as e:
             return False, f"❌ Error importing from clipboard: {str(e)}"
 
-    def get_smart_best_proxy(self) -> Optional[str]:
-        """پیدا کردن بهترین پروکسی از بین نتایج تست و فایل working"""
-        best_proxy = None
-        best_http_time = float('inf')
-        best_ping = float('inf')
+    def _smart_candidates(self) -> List[tuple[str, str]]:
+        """(پروکسی، پروتکل) کاندیدها: نتایج سالم به ترتیب rank_by، بعد جدیدترین‌های فایل working"""
+        limit = self.settings['smart_connect_candidates']
+        active_results = sorted((r for r in self.test_results if r.status == ProxyStatus.ACTIVE),
+                                key=self._rank_key)
+        candidates = {r.proxy: r.protocol for r in active_results[:limit]}
         
-        # بررسی پروکسی‌های تست شده
-        for result in self.test_results:
-            if result.status == ProxyStatus.ACTIVE:
-                if result.http_time < best_http_time:
-                    best_http_time = result.http_time
-                    best_ping = result.ping
-                    best_proxy = result.proxy
-                elif result.http_time == best_http_time and result.ping < best_ping:
-                    best_ping = result.ping
-                    best_proxy = result.proxy
-        
-        # اگر پروکسی فعالی در نتایج تست نبود، فایل working را بررسی کن
-        if not best_proxy and os.path.exists(self.working_proxies_file):
+        if len(candidates) < limit and os.path.exists(self.working_proxies_file):
             try:
                 with open(self.working_proxies_file, 'r', encoding='utf-8') as f:
                     working_proxies = [line.strip() for line in f 
                                      if line.strip() and not line.startswith('#')]
-                
-                # اولین پروکسی از فایل working را انتخاب کن
-                if working_proxies:
-                    best_proxy = working_proxies[0]
+                # فایل به صورت append نوشته می‌شود - آخرین خطوط تازه‌ترین هستند
+                for proxy in reversed(working_proxies):
+                    if len(candidates) >= limit:
+                        break
+                    candidates.setdefault(proxy, 'http')
             except Exception as e:
                 logger.error(f"Error reading working proxies file: {e}")
         
+        return list(candidates.items())
+
+    async def _race_candidates(self, candidates: List[tuple[str, str]]) -> Optional[str]:
+        """probe کوتاه همزمان روی همه کاندیدها - اولین پروکسی که 200 برگرداند"""
+        url = self._origin_probe_url()
+        timeout = self.settings['smart_connect_timeout']
+        
+        async def probe(proxy: str, protocol: str) -> str:
+            conn, request = await self._open_through(proxy, protocol, url)
+            try:
+                response = await conn.request(request, timeout)
+            finally:
+                conn.abort()
+            if response.status != 200:
+                raise ConnectionError(f"status {response.status}")
+            return proxy
+        
+        attempts = [asyncio.create_task(asyncio.wait_for(probe(proxy, protocol), timeout))
+                    for proxy, protocol in candidates]
+        try:
+            for next_done in asyncio.as_completed(attempts):
+                try:
+                    return await next_done
+                except Exception as e:
+                    logger.debug(f"Smart connect candidate failed: {e!r}")
+            return None
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    def get_smart_best_proxy(self) -> Optional[str]:
+        """پیدا کردن بهترین پروکسی از بین نتایج تست و فایل working
+        
+        کاندیدها همزمان با یک درخواست کوتاه امتحان می‌شوند و اولین پاسخ‌دهنده انتخاب
+        می‌شود - حدود یک RTT به جای اسکن دوباره یا انتخاب بدون بررسی.
+        """
+        candidates = self._smart_candidates()
+        if not candidates:
+            return None
+        start = time.perf_counter()
+        best_proxy = asyncio.run(self._race_candidates(candidates))
+        elapsed = int((time.perf_counter() - start) * 1000)
+        if best_proxy:
+            logger.info(f"Smart connect picked {best_proxy} of {len(candidates)} candidates in {elapsed}ms")
+        else:
+            logger.warning(f"None of {len(candidates)} cached candidates answered within {elapsed}ms")
         return best_proxy
 
+def _shard_worker(shard_id: int, proxies: List[str], settings: dict, result_queue, stop_event):
+    """اجرای یک shard در پروسس جداگانه و ارسال دسته‌ای نتایج به پروسس والد"""
+    backend = ProxyBackend()
+    backend.settings.update(settings)
+    backend.proxy_list = proxies
+    # ذخیره همزمان چند پروسس روی یک فایل تداخل دارد؛ ورودی‌های جدید به والد فرستاده می‌شوند
+    backend.enrich_cache.path = None
+    
+    batch = []
+    last_flush = time.monotonic()
+    
+    def send_result(data: dict):
+        nonlocal last_flush
+        batch.append(data)
+        if len(batch) >= 64 or time.monotonic() - last_flush > 0.2:
+            result_queue.put(('results', batch[:]))
+            batch.clear()
+            last_flush = time.monotonic()
+    
+    finished = threading.Event()
+    
+    def watch_stop():
+        stop_event.wait()
+        backend.stop_testing()
+        # Stop ممکن است قبل از شروع اسکن این پروسس رسیده باشد
+        while not finished.wait(0.05):
+            if backend.is_testing:
+                backend.stop_testing()
+    
+    threading.Thread(target=watch_stop, daemon=True).start()
+    
+    def send_update(data: dict):
+        result_queue.put(('updates', [data]))
+    
+    try:
+        asyncio.run(backend.run_full_test_async(result_callback=send_result, update_callback=send_update))
+    except Exception as e:
+        logger.error(f"Shard {shard_id} failed: {e}")
+    finally:
+        finished.set()
+        if batch:
+            result_queue.put(('results', batch))
+        result_queue.put(('cache', backend.enrich_cache.export_updates()))
+        result_queue.put(('done', shard_id))
+
 # تست واحد
 if __name__ == "__main__":
     async def test_backend():
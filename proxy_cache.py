@@ -0,0 +1,82 @@
+# proxy_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """کش پایه با TTL برای هر ورودی، حذف LRU، یکی کردن درخواست‌های همزمان و آمار hit/miss
+
+    انقضا با ساعت سیستم (time.time) ذخیره می‌شود تا ورودی‌ها بین اجراها قابل ذخیره باشند.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def lookup(self, key: Hashable) -> Optional[Any]:
+        """مقدار معتبر یا None - ورودی منقضی حذف می‌شود"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def store(self, key: Hashable, value: Any, ttl: float):
+        self._insert(key, time.time() + ttl, value)
+
+    def _insert(self, key: Hashable, expires: float, value: Any):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Tuple[Any, float]]]) -> Any:
+        """خواندن از کش یا اجرای fetch که (مقدار، TTL) برمی‌گرداند - درخواست‌های همزمان یکی می‌شوند"""
+        value = self.lookup(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value, ttl = await fetch()
+            self.store(key, value, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # جلوگیری از هشدار "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': ((self.hits + self.coalesced) / lookups * 100) if lookups else 0
+        }
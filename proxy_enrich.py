@@ -0,0 +1,206 @@
+# proxy_enrich.py
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from proxy_cache import TTLCache
+
+logger = logging.getLogger('ProxyEnrich')
+
+# (country, country_code, isp)
+GeoInfo = Tuple[str, str, str]
+UNKNOWN_GEO: GeoInfo = ("Unknown", "XX", "Unknown")
+
+
+class EnrichmentCache(TTLCache):
+    """کش اطلاعات کشور/ISP بر اساس IP با TTL، حذف LRU و ذخیره روی دیسک"""
+
+    def __init__(self, path: str = None, ttl: float = 86400, negative_ttl: float = 600,
+                 max_size: int = 50000):
+        super().__init__(max_size)
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # IP هایی که از زمان load مقدار تازه گرفته‌اند (برای ارسال به پروسس والد)
+        self._updated = set()
+
+    def _ttl_for(self, value: GeoInfo) -> float:
+        # نتیجه ناموفق زودتر منقضی می‌شود تا دوباره امتحان شود
+        return self.negative_ttl if tuple(value) == UNKNOWN_GEO else self.ttl
+
+    def _insert(self, ip: str, expires: float, value: GeoInfo):
+        super()._insert(ip, expires, tuple(value))
+        self._updated.add(ip)
+
+    def get(self, ip: str) -> Optional[GeoInfo]:
+        return self.lookup(ip)
+
+    def put(self, ip: str, value: GeoInfo):
+        self.store(ip, value, self._ttl_for(value))
+
+    async def get_or_fetch(self, ip: str, fetch: Callable[[], Awaitable[GeoInfo]]) -> GeoInfo:
+        """خواندن از کش یا اجرای fetch - درخواست‌های همزمان برای یک IP یکی می‌شوند"""
+        async def fetch_with_ttl():
+            value = await fetch()
+            return value, self._ttl_for(value)
+        return await super().get_or_fetch(ip, fetch_with_ttl)
+
+    def export_updates(self) -> Dict[str, Tuple[float, GeoInfo]]:
+        """ورودی‌هایی که در این اجرا اضافه شده‌اند - برای ادغام در کش پروسس دیگر"""
+        return {ip: self._entries[ip] for ip in self._updated if ip in self._entries}
+
+    def merge(self, entries: Dict[str, Tuple[float, GeoInfo]]):
+        """ادغام ورودی‌های export_updates - در تعارض، ورودی با انقضای دیرتر می‌ماند"""
+        now = time.time()
+        for ip, (expires, value) in entries.items():
+            current = self._entries.get(ip)
+            if expires <= now or (current is not None and current[0] >= expires):
+                continue
+            self._insert(ip, expires, value)
+
+    def load(self):
+        """لود کش از فایل - ورودی‌های منقضی نادیده گرفته می‌شوند"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            for ip, (expires, value) in data.items():
+                if expires > now:
+                    self._entries[ip] = (expires, tuple(value))
+            logger.info(f"Enrichment cache loaded: {len(self._entries)} entries")
+        except Exception as e:
+            logger.error(f"Error loading enrichment cache: {e}")
+
+    def save(self):
+        """ذخیره کش در فایل"""
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving enrichment cache: {e}")
+
+
+class GeoIPProvider:
+    """provider محلی بر اساس proxy_geoip.GeoIPDatabase"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def lookup_batch(self, ips: List[str]) -> Dict[str, GeoInfo]:
+        results = {}
+        for ip in ips:
+            record = self.db.lookup(ip)
+            results[ip] = record.geo_info() if record else UNKNOWN_GEO
+        return results
+
+
+class IpApiBatchProvider:
+    """provider مبتنی بر endpoint دسته‌ای ip-api.com (حداکثر 100 IP در هر درخواست)"""
+
+    BATCH_URL = 'http://ip-api.com/batch?fields=status,country,countryCode,isp,query'
+    batch_size = 100
+
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+        self._resume_at = 0.0
+
+    async def lookup_batch(self, ips: List[str]) -> Dict[str, GeoInfo]:
+        # رعایت محدودیت نرخ اعلام شده در هدرهای X-Rl / X-Ttl
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        results = {}
+        async with self.session.post(
+            self.BATCH_URL,
+            json=ips[:self.batch_size],
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            if response.headers.get('X-Rl') == '0':
+                self._resume_at = time.monotonic() + int(response.headers.get('X-Ttl', '60'))
+            if response.status != 200:
+                logger.warning(f"Batch geo lookup failed with status {response.status}")
+                return results
+            for item in await response.json():
+                if item.get('status') == 'success':
+                    results[item['query']] = (item.get('country', 'Unknown'),
+                                              item.get('countryCode', 'XX'),
+                                              item.get('isp', 'Unknown'))
+        return results
+
+
+class BatchEnricher:
+    """مرحله enrichment جدا از مسیر probe: جمع‌آوری IP ها و جستجوی دسته‌ای"""
+
+    def __init__(self, provider, cache: EnrichmentCache, on_update: Callable[[str, GeoInfo], None],
+                 batch_size: int = 100, max_delay: float = 0.5):
+        self.provider = provider
+        self.cache = cache
+        self.on_update = on_update
+        self.batch_size = min(batch_size, getattr(provider, 'batch_size', batch_size))
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def submit(self, ip: str):
+        self._queue.put_nowait(ip)
+
+    def close(self):
+        """پایان ورودی - run بعد از پردازش باقی‌مانده برمی‌گردد"""
+        self._queue.put_nowait(None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            ip = await self._queue.get()
+            if ip is None:
+                return
+            batch = [ip]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    ip = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if ip is None:
+                    finished = True
+                    break
+                batch.append(ip)
+            await self._process(batch)
+
+    async def _process(self, batch: List[str]):
+        misses = []
+        for ip in dict.fromkeys(batch):
+            value = self.cache.get(ip)
+            if value is not None:
+                self.cache.hits += 1
+                self.on_update(ip, value)
+            else:
+                self.cache.misses += 1
+                misses.append(ip)
+        if not misses:
+            return
+
+        try:
+            found = await self.provider.lookup_batch(misses)
+        except Exception as e:
+            logger.warning(f"Batch enrichment failed for {len(misses)} IPs: {e}")
+            found = {}
+        for ip in misses:
+            value = found.get(ip, UNKNOWN_GEO)
+            self.cache.put(ip, value)
+            self.on_update(ip, value)
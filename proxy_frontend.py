@@ -31,6 +31,7 @@ class ModernProxyFrontend:
         # متغیرهای وضعیت
         self.is_connected = False
         self.current_filters = {}
+        self.result_items = {}
         
         # پالت رنگ مدرن
         self.setup_colors()
@@ -195,6 +196,18 @@ class ModernProxyFrontend:
                                  activeforeground=self.colors['text_primary'])
         https_cb.pack(anchor='w', pady=2)
         
+        # تست همزمان با خواندن فایل پروکسی
+        self.stream_var = tk.BooleanVar(value=self.backend.settings['stream_load'])
+        stream_cb = tk.Checkbutton(settings_frame, text="Stream Load", 
+                                  variable=self.stream_var,
+                                  command=self.toggle_stream_load,
+                                  bg=self.colors['darker_card'],
+                                  fg=self.colors['text_primary'],
+                                  selectcolor=self.colors['dark_card'],
+                                  activebackground=self.colors['darker_card'],
+                                  activeforeground=self.colors['text_primary'])
+        stream_cb.pack(anchor='w', pady=2)
+        
     def setup_quick_stats(self):
         """آمار سریع در سایدبار"""
         stats_frame = tk.Frame(self.sidebar, bg=self.colors['darker_card'])
@@ -458,7 +471,8 @@ class ModernProxyFrontend:
         
         self.sort_var = tk.StringVar(value='http_time')
         sort_combo = ttk.Combobox(control_frame, textvariable=self.sort_var,
-                                 values=['ping', 'http_time', 'status', 'proxy', 'country'], 
+                                 values=['ping', 'http_time', 'ttfb', 'total', 'dns', 'tcp', 'connect', 'tls',
+                                         'rank', 'p50', 'p95', 'jitter', 'bandwidth', 'status', 'proxy', 'country'], 
                                  state='readonly', width=12)
         sort_combo.pack(side='left', padx=5)
         sort_combo.bind('<<ComboboxSelected>>', self.sort_results)
@@ -472,7 +486,7 @@ class ModernProxyFrontend:
         table_container.pack(fill='both', expand=True)
         
         # ایجاد Treeview با استایل مدرن
-        columns = ('#', 'Proxy', 'Country', 'Ping', 'HTTP Time', 'Anonymity', 'Status')
+        columns = ('#', 'Proxy', 'Type', 'Country', 'Ping', 'HTTP Time', 'Anonymity', 'Status')
         self.results_tree = ttk.Treeview(table_container, columns=columns, 
                                        show='headings', height=12, style="Modern.Treeview")
         
@@ -480,6 +494,7 @@ class ModernProxyFrontend:
         column_config = {
             '#': {'width': 50, 'anchor': 'center'},
             'Proxy': {'width': 200, 'anchor': 'w'},
+            'Type': {'width': 70, 'anchor': 'center'},
             'Country': {'width': 120, 'anchor': 'center'},
             'Ping': {'width': 80, 'anchor': 'center'},
             'HTTP Time': {'width': 100, 'anchor': 'center'},
@@ -725,13 +740,18 @@ class ModernProxyFrontend:
         dialog.bind('<Return>', lambda e: add_proxy())
         dialog.bind('<Escape>', lambda e: dialog.destroy())
         
-    def start_test(self, event=None):
-        """شروع تست"""
+    def start_test(self, event=None, quick=False, on_complete=None):
+        """شروع تست - با quick جستجوی سریع top-k و بعد از پایان on_complete در UI thread"""
         if self.testing_active:
             self.show_notification("Info", "Test is already in progress", "info")
             return
             
-        if not self.backend.proxy_list:
+        # در حالت stream_load فایل همزمان با تست خوانده می‌شود
+        stream_file = None
+        if self.backend.settings['stream_load'] and not quick and self.backend.proxy_file:
+            stream_file = self.backend.proxy_file
+        
+        if not self.backend.proxy_list and not stream_file:
             self.show_notification("Error", "No proxies loaded. Please load proxies first.", "error")
             return
             
@@ -744,8 +764,9 @@ class ModernProxyFrontend:
         for item in self.results_tree.get_children():
             self.results_tree.delete(item)
         
-        # ریست کردن نتایج قبلی در بک‌اند
-        self.backend.test_results.clear()
+        # ریست کردن نتایج قبلی در بک‌اند - در حالت incremental نتایج تازه دوباره به جدول فرستاده می‌شوند
+        if not self.backend.settings['incremental']:
+            self.backend.test_results.clear()
         
         # اجرای تست در thread جداگانه
         def run_async_test():
@@ -755,9 +776,18 @@ class ModernProxyFrontend:
                 asyncio.set_event_loop(loop)
                 
                 async def run_test():
-                    return await self.backend.run_full_test_async(
+                    if stream_file:
+                        return await self.backend.run_stream_test_async(
+                            stream_file,
+                            progress_callback=self.update_progress,
+                            result_callback=self.add_result_to_table,
+                            update_callback=self.update_result_in_table
+                        )
+                    run = self.backend.run_topk_test_async if quick else self.backend.run_full_test_async
+                    return await run(
                         progress_callback=self.update_progress,
-                        result_callback=self.add_result_to_table
+                        result_callback=self.add_result_to_table,
+                        update_callback=self.update_result_in_table
                     )
                 
                 result = loop.run_until_complete(run_test())
@@ -767,10 +797,11 @@ class ModernProxyFrontend:
                 loop.close()
                 
                 # ارسال نتیجه به UI thread
-                self.root.after(0, lambda: self.test_completed(result))
+                self.root.after(0, lambda: self.test_completed(result, on_complete))
                 
             except Exception as e:
-                self.root.after(0, lambda: self.test_completed((False, {"error": str(e)})))
+                message = str(e)
+                self.root.after(0, lambda: self.test_completed((False, {"error": message})))
         
         threading.Thread(target=run_async_test, daemon=True).start()
             
@@ -784,11 +815,26 @@ class ModernProxyFrontend:
             self.live_counter.config(text="")
             self.show_notification("Info", "Test stopped", "info")
 
-    def smart_connect(self, event=None):
-        """اتصال هوشمند - بهترین پروکسی را پیدا کرده و متصل می‌شود"""
-        best_proxy = self.backend.get_smart_best_proxy()
+    def smart_connect(self, event=None, allow_search=True):
+        """اتصال هوشمند - کاندیدهای کش شده همزمان امتحان و اولین پاسخ‌دهنده متصل می‌شود"""
+        if self.testing_active:
+            return
+        self.update_go_animation('testing')
         
+        # race کاندیدها در thread جداگانه تا UI بلاک نشود
+        def pick_proxy():
+            best_proxy = self.backend.get_smart_best_proxy()
+            self.root.after(0, lambda: self.apply_smart_proxy(best_proxy, allow_search))
+        
+        threading.Thread(target=pick_proxy, daemon=True).start()
+
+    def apply_smart_proxy(self, best_proxy, allow_search=False):
+        """ست کردن پروکسی انتخاب شده توسط smart_connect"""
         if not best_proxy:
+            if allow_search and self.backend.proxy_list:
+                # هیچ کاندید کش شده‌ای جواب نداد: جستجوی سریع top-k به جای اسکن کامل
+                self.start_test(quick=True, on_complete=lambda: self.smart_connect(allow_search=False))
+                return
             self.update_go_animation('disconnected')
             self.show_notification("Error", "No active proxy found. Please run a test first.", "error")
             return
@@ -858,6 +904,7 @@ class ModernProxyFrontend:
                 item_id = self.results_tree.insert('', 'end', values=(
                     len(self.backend.test_results),
                     result.get('proxy', ''),
+                    result.get('protocol', 'http').upper(),
                     self.get_country_flag(result.get('country_code', 'XX')) + " " + result.get('country', 'Unknown'),
                     f"{ping}ms",
                     f"{result.get('http_time', 0)}ms",
@@ -865,6 +912,8 @@ class ModernProxyFrontend:
                     f"{status_icon} {result.get('status', 'Unknown')}"
                 ))
                 
+                self.result_items[result.get('proxy', '')] = item_id
+                
                 # اسکرول به آخر
                 self.results_tree.see(item_id)
                 
@@ -873,6 +922,31 @@ class ModernProxyFrontend:
         
         self.root.after(0, add_to_ui)
 
+    def update_result_in_table(self, result):
+        """آپدیت درجای ردیف با اطلاعات تکمیلی (کشور/ISP) که بعداً رسیده"""
+        def update_ui():
+            try:
+                proxy = result.get('proxy', '')
+                item_id = self.result_items.get(proxy)
+                if not item_id or not self.results_tree.exists(item_id) \
+                        or self.results_tree.item(item_id, 'values')[1] != proxy:
+                    # جدول بعد از سورت یا فیلتر دوباره ساخته شده است
+                    item_id = next((item for item in self.results_tree.get_children()
+                                    if self.results_tree.item(item, 'values')[1] == proxy), None)
+                    if not item_id:
+                        return
+                    self.result_items[proxy] = item_id
+                
+                self.results_tree.set(item_id, 'Country',
+                                      self.get_country_flag(result.get('country_code', 'XX')) + " " +
+                                      result.get('country', 'Unknown'))
+                self.results_tree.set(item_id, 'Anonymity', result.get('anonymity', 'Unknown'))
+                
+            except Exception as e:
+                print(f"Error updating result in table: {e}")
+        
+        self.root.after(0, update_ui)
+
     def get_country_flag(self, country_code: str) -> str:
         """دریافت پرچم کشور بر اساس کد"""
         flag_emojis = {
@@ -883,7 +957,7 @@ class ModernProxyFrontend:
         }
         return flag_emojis.get(country_code.upper(), '🌐')
         
-    def test_completed(self, result):
+    def test_completed(self, result, on_complete=None):
         """پایان تست"""
         self.testing_active = False
         self.update_go_animation('ready')
@@ -910,6 +984,9 @@ class ModernProxyFrontend:
                                     f"Active: {stats.get('active', 0)}/{stats.get('total', 0)}\n"
                                     f"Best HTTP Time: {stats.get('best_http_time', 0)}ms")
                     self.show_notification("Test Complete", notification_text, "success")
+            
+            if on_complete and stats.get('top_proxies'):
+                on_complete()
         else:
             error_msg = stats.get('error', 'Unknown error') if isinstance(stats, dict) else 'Test failed'
             self.show_notification("Error", f"Proxy testing failed: {error_msg}", "error")
@@ -955,6 +1032,10 @@ class ModernProxyFrontend:
     def auto_set_best_proxy(self):
         """تنظیم اتوماتیک بهترین پروکسی"""
         if not self.backend.best_proxy:
+            if self.backend.proxy_list and not self.testing_active:
+                # جستجوی سریع top-k و تنظیم بعد از پایان
+                self.start_test(quick=True, on_complete=self.auto_set_best_proxy)
+                return
             self.show_notification("Error", "No best proxy available. Run a test first.", "error")
             return
             
@@ -1130,6 +1211,7 @@ class ModernProxyFrontend:
             self.results_tree.insert('', 'end', values=(
                 i, 
                 result['proxy'], 
+                result.get('protocol', 'http').upper(),
                 self.get_country_flag(result.get('country_code', 'XX')) + " " + result.get('country', 'Unknown'),
                 f"{result['ping']}ms", 
                 f"{result['http_time']}ms", 
@@ -1185,6 +1267,10 @@ class ModernProxyFrontend:
         """تغییر وضعیت تست HTTPS"""
         self.backend.update_settings({'test_https': self.https_var.get()})
         
+    def toggle_stream_load(self):
+        """تغییر حالت خواندن تدریجی فایل پروکسی"""
+        self.backend.update_settings({'stream_load': self.stream_var.get()})
+        
     def show_about(self):
         """نمایش صفحه درباره"""
         about_text = f"""🌐 ProxyMaster Pro v{self.version}
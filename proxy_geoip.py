@@ -0,0 +1,235 @@
+# proxy_geoip.py
+# پایگاه داده آفلاین GeoIP/ASN: جدول بازه‌های مرتب IPv4 که با mmap باز می‌شود
+#
+# ساخت از CSV (ستون‌ها: start,end,country_code[,country[,asn[,isp]]]):
+#   python proxy_geoip.py build ip2location.csv geoip.dat
+# جستجو:
+#   python proxy_geoip.py lookup geoip.dat 8.8.8.8
+import argparse
+import csv
+import ipaddress
+import logging
+import mmap
+import os
+import socket
+import struct
+from array import array
+from bisect import bisect_right
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger('ProxyGeoIP')
+
+MAGIC = b'PXGEO1\0\0'
+# magic، تعداد بازه‌ها، تعداد رشته‌ها، اندازه blob رشته‌ها
+_HEADER = struct.Struct('<8sIII')
+
+
+class GeoRecord(NamedTuple):
+    country: str
+    country_code: str
+    asn: str
+    isp: str
+
+    def geo_info(self) -> Tuple[str, str, str]:
+        """(country, country_code, isp) با پیشوند ASN در ISP"""
+        isp = f"{self.asn} {self.isp}" if self.asn else self.isp
+        return self.country, self.country_code, isp
+
+
+def ip_to_int(value: str) -> Optional[int]:
+    """تبدیل IPv4 (نقطه‌دار یا عدد صحیح) به int - None برای مقدار نامعتبر/IPv6"""
+    value = value.strip().strip('"')
+    if value.isdigit():
+        number = int(value)
+        return number if number <= 0xFFFFFFFF else None
+    if value.count('.') != 3:
+        return None
+    try:
+        return int.from_bytes(socket.inet_aton(value), 'big')
+    except OSError:
+        return None
+
+
+def _pad4(blob: bytes) -> bytes:
+    return blob + b'\0' * (-len(blob) % 4)
+
+
+def build_geoip_db(csv_path: str, db_path: str) -> int:
+    """ساخت فایل باینری از CSV - تعداد بازه‌های نوشته شده"""
+    rows: List[Tuple[int, int, Tuple[str, str, str, str]]] = []
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            start, end = ip_to_int(row[0]), ip_to_int(row[1])
+            if start is None or end is None or end < start:
+                # هدر CSV یا ردیف IPv6
+                continue
+            code = row[2].strip() or 'XX'
+            country = row[3].strip() if len(row) > 3 else ''
+            asn = row[4].strip() if len(row) > 4 else ''
+            isp = row[5].strip() if len(row) > 5 else ''
+            if code == '-':
+                continue
+            rows.append((start, end, (country or 'Unknown', code, asn, isp or 'Unknown')))
+    rows.sort(key=lambda r: r[0])
+
+    # جدول رشته‌ها: هر رکورد یکتا یک بار ذخیره می‌شود
+    record_index = {}
+    starts, ends, refs = array('I'), array('I'), array('I')
+    for start, end, record in rows:
+        starts.append(start)
+        ends.append(end)
+        refs.append(record_index.setdefault(record, len(record_index)))
+
+    blob = bytearray()
+    offsets = array('I', [0])
+    for record in record_index:
+        blob += '\t'.join(record).encode('utf-8')
+        offsets.append(len(blob))
+
+    with open(db_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(starts), len(record_index), len(blob)))
+        f.write(starts.tobytes())
+        f.write(ends.tobytes())
+        f.write(refs.tobytes())
+        f.write(offsets.tobytes())
+        f.write(_pad4(bytes(blob)))
+
+    logger.info(f"GeoIP database built: {len(starts)} ranges, {len(record_index)} records -> {db_path}")
+    return len(starts)
+
+
+class GeoIPDatabase:
+    """جستجوی O(log n) روی بازه‌های mmap شده"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, record_count, blob_size = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a GeoIP database: {path}")
+
+        view = memoryview(self._mmap)
+        offset = _HEADER.size
+        self._starts = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self._ends = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self._refs = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self._offsets = view[offset:offset + (record_count + 1) * 4].cast('I')
+        offset += (record_count + 1) * 4
+        self._blob = view[offset:offset + blob_size]
+        self._cache = {}
+        self.count = count
+
+    def lookup(self, ip: str) -> Optional[GeoRecord]:
+        """پیدا کردن بازه شامل ip"""
+        number = ip_to_int(ip)
+        if number is None:
+            return None
+        index = bisect_right(self._starts, number) - 1
+        if index < 0 or number > self._ends[index]:
+            return None
+        return self._record(self._refs[index])
+
+    def _record(self, ref: int) -> GeoRecord:
+        record = self._cache.get(ref)
+        if record is None:
+            raw = bytes(self._blob[self._offsets[ref]:self._offsets[ref + 1]])
+            record = GeoRecord(*raw.decode('utf-8').split('\t'))
+            self._cache[ref] = record
+        return record
+
+    def close(self):
+        for name in ('_starts', '_ends', '_refs', '_offsets', '_blob'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class CIDRSet:
+    """مجموعه فشرده CIDR های IPv4: بازه‌های مرتب و ادغام شده با جستجوی bisect"""
+
+    def __init__(self, cidrs: Iterable[str] = ()):
+        self._starts = array('I')
+        self._ends = array('I')
+        self.update(cidrs)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'CIDRSet':
+        """خواندن یک CIDR در هر خط - خطوط # نادیده گرفته می‌شوند"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(line.split('#', 1)[0].strip() for line in f)
+
+    def update(self, cidrs: Iterable[str]):
+        ranges = list(zip(self._starts, self._ends))
+        for cidr in cidrs:
+            if not cidr:
+                continue
+            try:
+                network = ipaddress.IPv4Network(cidr, strict=False)
+            except ValueError:
+                logger.debug(f"Skipping invalid CIDR: {cidr}")
+                continue
+            ranges.append((int(network.network_address), int(network.broadcast_address)))
+        ranges.sort()
+
+        # ادغام بازه‌های هم‌پوشان یا چسبیده
+        starts, ends = array('I'), array('I')
+        for start, end in ranges:
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self._starts, self._ends = starts, ends
+
+    def __contains__(self, ip: str) -> bool:
+        number = ip_to_int(ip)
+        if number is None:
+            return False
+        index = bisect_right(self._starts, number) - 1
+        return index >= 0 and number <= self._ends[index]
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+
+def open_geoip_db(path: str) -> Optional[GeoIPDatabase]:
+    """باز کردن پایگاه داده اگر وجود دارد"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        db = GeoIPDatabase(path)
+        logger.info(f"GeoIP database loaded: {db.count} ranges from {path}")
+        return db
+    except (OSError, ValueError, struct.error) as e:
+        logger.error(f"Error loading GeoIP database: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline GeoIP range database")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build')
+    build.add_argument('csv_path')
+    build.add_argument('db_path')
+    lookup = sub.add_parser('lookup')
+    lookup.add_argument('db_path')
+    lookup.add_argument('ips', nargs='+')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'build':
+        build_geoip_db(args.csv_path, args.db_path)
+    else:
+        db = GeoIPDatabase(args.db_path)
+        for ip in args.ips:
+            print(ip, db.lookup(ip))
+        db.close()
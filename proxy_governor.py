@@ -0,0 +1,134 @@
+# proxy_governor.py
+import asyncio
+import logging
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # ویندوز: RLIMIT_NOFILE وجود ندارد
+    resource = None
+
+logger = logging.getLogger('ProxyGovernor')
+
+
+def raise_nofile_limit(target: int = 65536) -> Optional[int]:
+    """بالا بردن soft limit تعداد file descriptor تا حد hard - مقدار نهایی یا None"""
+    if resource is None:
+        return None
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = target if hard == resource.RLIM_INFINITY else min(target, hard)
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+            logger.info(f"RLIMIT_NOFILE raised from {soft} to {wanted}")
+            soft = wanted
+        return None if soft == resource.RLIM_INFINITY else soft
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not raise RLIMIT_NOFILE: {e}")
+        return None
+
+
+class ResourceGovernor:
+    """پایش fd، سوکت‌ها، TIME_WAIT و RSS و توقف موقت اسکنر قبل از رسیدن به سقف
+
+    RSS فقط هشدار می‌دهد: حافظه با مکث آزاد نمی‌شود و توقف روی آن اسکن را برای همیشه نگه می‌داشت.
+    """
+
+    def __init__(self, fd_ratio: float = 0.8, max_sockets: int = 8000, max_time_wait: int = 20000,
+                 max_rss_mb: int = 1024, interval: float = 1.0, max_wait: float = 10.0):
+        self.fd_ratio = fd_ratio
+        self.max_sockets = max_sockets
+        self.max_time_wait = max_time_wait
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.interval = interval
+        self.max_wait = max_wait
+        self.fd_limit = raise_nofile_limit()
+        self.process = psutil.Process() if psutil else None
+        self.last_snapshot: dict = {}
+        self.throttle_count = 0
+        self._rss_warned = False
+        self._wait_warned = False
+        self._ready = asyncio.Event()
+        self._ready.set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.process is not None
+
+    def snapshot(self) -> dict:
+        """خواندن وضعیت فعلی منابع (بلاک‌کننده - در executor اجرا شود)"""
+        snap = {'fd_limit': self.fd_limit, 'open_fds': None, 'sockets': None, 'time_wait': None, 'rss': None}
+        if not self.process:
+            return snap
+        try:
+            if hasattr(self.process, 'num_fds'):
+                snap['open_fds'] = self.process.num_fds()
+            else:
+                snap['open_fds'] = self.process.num_handles()
+            snap['rss'] = self.process.memory_info().rss
+            if hasattr(self.process, 'net_connections'):
+                snap['sockets'] = len(self.process.net_connections(kind='inet'))
+            else:
+                snap['sockets'] = len(self.process.connections(kind='inet'))
+        except psutil.Error as e:
+            logger.debug(f"Process stats unavailable: {e}")
+        try:
+            snap['time_wait'] = sum(1 for c in psutil.net_connections(kind='tcp')
+                                    if c.status == psutil.CONN_TIME_WAIT)
+        except (psutil.Error, OSError) as e:
+            logger.debug(f"TIME_WAIT count unavailable: {e}")
+        return snap
+
+    def overload_reason(self, snap: dict) -> Optional[str]:
+        """دلیل فشار منابع یا None"""
+        if snap['fd_limit'] and snap['open_fds'] is not None and snap['open_fds'] > snap['fd_limit'] * self.fd_ratio:
+            return f"file descriptors {snap['open_fds']}/{snap['fd_limit']}"
+        if snap['sockets'] is not None and snap['sockets'] > self.max_sockets:
+            return f"open sockets {snap['sockets']}"
+        if snap['time_wait'] is not None and snap['time_wait'] > self.max_time_wait:
+            return f"TIME_WAIT sockets {snap['time_wait']}"
+        return None
+
+    async def wait_ready(self):
+        """انتظار تا آزاد شدن منابع - حداکثر max_wait ثانیه، بعد کار با هشدار ادامه می‌یابد"""
+        if self._ready.is_set():
+            return
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            if not self._wait_warned:
+                self._wait_warned = True
+                logger.warning(f"Resource pressure persisted for {self.max_wait:g}s, "
+                               f"continuing at reduced rate")
+
+    async def run(self):
+        """حلقه پایش - تا cancel شدن اجرا می‌شود"""
+        if not self.enabled:
+            logger.warning("psutil not available, resource governor disabled")
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                self.last_snapshot = await loop.run_in_executor(None, self.snapshot)
+                reason = self.overload_reason(self.last_snapshot)
+                rss = self.last_snapshot['rss']
+                if rss is not None and rss > self.max_rss and not self._rss_warned:
+                    self._rss_warned = True
+                    logger.warning(f"Scanner memory usage high: RSS {rss // (1024 * 1024)} MB")
+                if reason and self._ready.is_set():
+                    self.throttle_count += 1
+                    logger.warning(f"Scanner throttled: {reason}")
+                    self._ready.clear()
+                elif not reason and not self._ready.is_set():
+                    logger.info("Scanner resumed: resources back under limits")
+                    self._wait_warned = False
+                    self._ready.set()
+                await asyncio.sleep(self.interval)
+        finally:
+            self._ready.set()
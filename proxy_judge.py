@@ -0,0 +1,86 @@
+# proxy_judge.py
+# سرور judge: هدرها و آدرس مبدأ دیده شده را برمی‌گرداند تا همان درخواست probe
+# آی‌پی خروجی و نشت هدرهای پروکسی را مشخص کند.
+# /payload?size=N هم N بایت برای تست پهنای باند می‌فرستد.
+# اجرا: python proxy_judge.py --host 0.0.0.0 --port 8899
+import argparse
+import logging
+import os
+
+from aiohttp import web
+
+logger = logging.getLogger('ProxyJudge')
+
+# هدرهایی که وجود پروکسی را لو می‌دهند
+REVEALING_HEADERS = (
+    'via', 'x-forwarded-for', 'forwarded', 'x-real-ip', 'client-ip', 'x-client-ip',
+    'x-proxy-id', 'proxy-connection', 'x-forwarded-host', 'x-forwarded-proto',
+)
+
+# هدرهایی که ممکن است آی‌پی واقعی کلاینت را حمل کنند
+FORWARDING_HEADERS = ('x-forwarded-for', 'forwarded', 'x-real-ip', 'client-ip', 'x-client-ip')
+
+# نتیجه در هدرهای پاسخ هم فرستاده می‌شود تا probe نیازی به پارس body نداشته باشد
+HEADER_REMOTE = 'X-Judge-Remote'
+HEADER_REVEALING = 'X-Judge-Revealing'
+HEADER_FORWARDED = 'X-Judge-Forwarded'
+
+# داده تصادفی (غیرقابل فشرده‌سازی) برای تست پهنای باند
+PAYLOAD_CHUNK = os.urandom(65536)
+MAX_PAYLOAD_SIZE = 100 * 1024 * 1024
+
+
+async def judge_handler(request: web.Request) -> web.Response:
+    """بازگرداندن آدرس مبدأ و هدرهای دریافتی"""
+    remote = request.remote or ''
+    headers = {name.lower(): value for name, value in request.headers.items()}
+    revealing = [name for name in REVEALING_HEADERS if name in headers]
+    forwarded = [headers[name] for name in FORWARDING_HEADERS if name in headers]
+
+    return web.json_response(
+        {'remote': remote, 'revealing': revealing, 'headers': headers},
+        headers={
+            HEADER_REMOTE: remote,
+            HEADER_REVEALING: ','.join(revealing),
+            HEADER_FORWARDED: ', '.join(forwarded),
+            'Cache-Control': 'no-store',
+        }
+    )
+
+
+async def payload_handler(request: web.Request) -> web.StreamResponse:
+    """ارسال size بایت داده برای تست پهنای باند (پیش‌فرض 1 MB)"""
+    try:
+        size = max(0, min(int(request.query.get('size', 1048576)), MAX_PAYLOAD_SIZE))
+    except ValueError:
+        raise web.HTTPBadRequest(text="size must be an integer")
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/octet-stream', 'Cache-Control': 'no-store'})
+    response.content_length = size
+    await response.prepare(request)
+    chunk = memoryview(PAYLOAD_CHUNK)
+    remaining = size
+    while remaining > 0:
+        part = chunk[:min(remaining, len(chunk))]
+        await response.write(part)
+        remaining -= len(part)
+    await response.write_eof()
+    return response
+
+
+def create_app() -> web.Application:
+    """ساخت اپلیکیشن judge"""
+    app = web.Application()
+    app.router.add_get('/', judge_handler)
+    app.router.add_get('/judge', judge_handler)
+    app.router.add_get('/payload', payload_handler)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proxy judge server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8899)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=args.host, port=args.port)
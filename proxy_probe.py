@@ -0,0 +1,284 @@
+# proxy_probe.py
+import asyncio
+import math
+import ssl
+import time
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# حداکثر اندازه هدر پاسخ که بافر می‌کنیم
+_MAX_HEADER_BYTES = 16384
+
+
+@lru_cache(maxsize=256)
+def build_proxy_request(url: str, keep_alive: bool = False) -> bytes:
+    """ساخت یک‌باره بایت‌های درخواست GET با absolute-URI برای هر URL"""
+    host = urlsplit(url).netloc
+    connection = 'keep-alive' if keep_alive else 'close'
+    return (f"GET {url} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            f"User-Agent: {USER_AGENT}\r\n"
+            f"Connection: {connection}\r\n\r\n").encode('ascii')
+
+
+@lru_cache(maxsize=256)
+def build_origin_request(url: str, keep_alive: bool = False) -> bytes:
+    """درخواست GET با origin-form برای تونل (SOCKS یا CONNECT) که مستقیم به مقصد می‌رسد"""
+    parts = urlsplit(url)
+    target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    connection = 'keep-alive' if keep_alive else 'close'
+    return (f"GET {target} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            f"User-Agent: {USER_AGENT}\r\n"
+            f"Connection: {connection}\r\n\r\n").encode('ascii')
+
+
+class PhaseTimings(NamedTuple):
+    """زمان هر مرحله probe به میکروثانیه - None برای مرحله‌ای که اندازه‌گیری نشده
+
+    connect: برقراری تونل (handshake SOCKS یا CONNECT)، ttfb: از ارسال درخواست تا هدر پاسخ.
+    """
+    dns: Optional[int] = None
+    tcp: Optional[int] = None
+    connect: Optional[int] = None
+    tls: Optional[int] = None
+    ttfb: Optional[int] = None
+    total: Optional[int] = None
+
+    @classmethod
+    def from_ns(cls, phases: Dict[str, int]) -> 'PhaseTimings':
+        return cls(*(phases[name] // 1000 if phases.get(name) is not None else None for name in cls._fields))
+
+    @classmethod
+    def from_ms(cls, data: Dict[str, float]) -> 'PhaseTimings':
+        return cls(*(round(data[name] * 1000) if data.get(name) is not None else None for name in cls._fields))
+
+    def to_ms(self) -> Dict[str, float]:
+        return {name: round(value / 1000, 3) for name, value in zip(self._fields, self) if value is not None}
+
+
+class LatencyStats(NamedTuple):
+    """توزیع TTFB چند درخواست پشت سر هم به میکروثانیه
+
+    jitter: میانگین اختلاف مطلق نمونه‌های متوالی، keep_alive: همه نمونه‌ها روی یک اتصال.
+    """
+    samples: int = 0
+    p50: Optional[int] = None
+    p95: Optional[int] = None
+    jitter: Optional[int] = None
+    keep_alive: bool = False
+
+    @classmethod
+    def from_samples(cls, samples_ns: List[int], keep_alive: bool) -> 'LatencyStats':
+        if not samples_ns:
+            return cls()
+        ordered = sorted(samples_ns)
+        count = len(ordered)
+        middle = count // 2
+        p50 = ordered[middle] if count % 2 else (ordered[middle - 1] + ordered[middle]) // 2
+        # nearest-rank
+        p95 = ordered[math.ceil(count * 0.95) - 1]
+        deltas = [abs(b - a) for a, b in zip(samples_ns, samples_ns[1:])]
+        jitter = sum(deltas) // len(deltas) if deltas else 0
+        return cls(count, p50 // 1000, p95 // 1000, jitter // 1000, keep_alive)
+
+    @classmethod
+    def from_ms(cls, data: Dict) -> 'LatencyStats':
+        if not data.get('samples'):
+            return cls()
+        return cls(data['samples'], *(round(data[name] * 1000) for name in ('p50', 'p95', 'jitter')),
+                   data.get('keep_alive', False))
+
+    def to_ms(self) -> Dict:
+        if not self.samples:
+            return {}
+        return {'samples': self.samples, 'p50': round(self.p50 / 1000, 3), 'p95': round(self.p95 / 1000, 3),
+                'jitter': round(self.jitter / 1000, 3), 'keep_alive': self.keep_alive}
+
+
+class ProbeResponse:
+    """پاسخ حداقلی: کد وضعیت، هدرهای خواسته شده و زمان تا دریافت هدرها"""
+
+    __slots__ = ('status', 'headers', 'elapsed_ns')
+
+    def __init__(self, status: int, headers: dict, elapsed_ns: int):
+        self.status = status
+        self.headers = headers
+        self.elapsed_ns = elapsed_ns
+
+    @property
+    def elapsed_ms(self) -> int:
+        return self.elapsed_ns // 1_000_000
+
+
+class _ProbeProtocol(asyncio.Protocol):
+    """پروتکل سبک که فقط status line و هدرهای لازم را پارس می‌کند"""
+
+    __slots__ = ('transport', 'waiter', 'buffer', 'wanted', 'started_ns', 'closed', 'raw', 'expect',
+                 'headers_ns', 'received', 'body_waiter', 'body_target')
+
+    def __init__(self):
+        self.transport = None
+        self.waiter: Optional[asyncio.Future] = None
+        self.buffer = b''
+        self.wanted: Tuple[bytes, ...] = ()
+        self.started_ns = 0
+        self.closed = False
+        # حالت raw برای handshake های باینری (SOCKS): بایت‌ها بافر و به تعداد خواسته شده تحویل می‌شوند
+        self.raw = False
+        self.expect = 0
+        # بدنه پاسخ نگه‌داری نمی‌شود - فقط تعداد بایت‌ها شمرده می‌شود
+        self.headers_ns = 0
+        self.received = 0
+        self.body_waiter: Optional[asyncio.Future] = None
+        self.body_target = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def feed_raw(self):
+        if self.waiter is not None and not self.waiter.done() and len(self.buffer) >= self.expect:
+            chunk, self.buffer = self.buffer[:self.expect], self.buffer[self.expect:]
+            self.waiter.set_result(chunk)
+
+    def count_body(self, size: int):
+        self.received += size
+        if self.body_waiter is not None and not self.body_waiter.done() and self.received >= self.body_target:
+            self.body_waiter.set_result(None)
+
+    def data_received(self, data: bytes):
+        if self.raw:
+            self.buffer += data
+            self.feed_raw()
+            return
+        if self.waiter is None or self.waiter.done():
+            self.count_body(len(data))
+            return
+        self.buffer += data
+        end = self.buffer.find(b'\r\n\r\n')
+        if end < 0:
+            if len(self.buffer) > _MAX_HEADER_BYTES:
+                self.waiter.set_exception(ValueError("Response header too large"))
+            return
+        self.headers_ns = time.perf_counter_ns()
+        elapsed = self.headers_ns - self.started_ns
+        lines = self.buffer[:end].split(b'\r\n')
+        body_start = len(self.buffer) - end - 4
+        self.buffer = b''
+        parts = lines[0].split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/') or not parts[1].isdigit():
+            self.waiter.set_exception(ValueError(f"Bad status line: {lines[0][:64]!r}"))
+            return
+        headers = {}
+        if self.wanted:
+            for line in lines[1:]:
+                name, _, value = line.partition(b':')
+                name = name.strip().lower()
+                if name in self.wanted:
+                    headers[name.decode('latin-1')] = value.strip().decode('latin-1')
+        self.waiter.set_result(ProbeResponse(int(parts[1]), headers, elapsed))
+        self.count_body(body_start)
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(exc or ConnectionResetError("Connection closed by proxy"))
+        if self.body_waiter is not None and not self.body_waiter.done():
+            # بسته شدن اتصال پایان بدنه است
+            self.body_waiter.set_result(None)
+
+
+class ProbeConnection:
+    """اتصال خام به پروکسی که می‌تواند درخواست‌های پیش‌ساخته را ارسال کند"""
+
+    __slots__ = ('transport', 'protocol', 'connect_ns', 'dns_ns')
+
+    def __init__(self, transport, protocol: _ProbeProtocol, connect_ns: int, dns_ns: int = 0):
+        self.transport = transport
+        self.protocol = protocol
+        self.connect_ns = connect_ns
+        self.dns_ns = dns_ns
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: float = 5) -> 'ProbeConnection':
+        """اتصال TCP به پروکسی و اندازه‌گیری زمان اتصال"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter_ns()
+        transport, protocol = await asyncio.wait_for(
+            loop.create_connection(_ProbeProtocol, host, port), timeout=timeout)
+        return cls(transport, protocol, time.perf_counter_ns() - start)
+
+    @property
+    def connect_ms(self) -> int:
+        return self.connect_ns // 1_000_000
+
+    @property
+    def is_closed(self) -> bool:
+        return self.protocol.closed
+
+    async def request(self, payload: bytes, timeout: float, wanted: Tuple[bytes, ...] = ()) -> ProbeResponse:
+        """ارسال درخواست و انتظار برای status line و هدرها"""
+        protocol = self.protocol
+        if protocol.closed:
+            raise ConnectionResetError("Connection already closed")
+        protocol.raw = False
+        protocol.received = 0
+        protocol.waiter = asyncio.get_running_loop().create_future()
+        protocol.wanted = wanted
+        protocol.started_ns = time.perf_counter_ns()
+        self.transport.write(payload)
+        return await asyncio.wait_for(protocol.waiter, timeout=timeout)
+
+    async def receive_body(self, size: int, timeout: float) -> Tuple[int, int]:
+        """انتظار برای size بایت از بدنه پاسخ آخر، حداکثر timeout ثانیه
+
+        (بایت‌های دریافتی، نانوثانیه از رسیدن هدرها) - با timeout مقدار دریافت شده تا آن لحظه.
+        """
+        protocol = self.protocol
+        if protocol.received < size and not protocol.closed:
+            protocol.body_target = size
+            protocol.body_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(protocol.body_waiter, timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                protocol.body_waiter = None
+        return protocol.received, time.perf_counter_ns() - protocol.headers_ns
+
+    def send(self, data: bytes):
+        """ارسال بایت خام - پاسخ با read_exact خوانده می‌شود"""
+        self.protocol.raw = True
+        self.transport.write(data)
+
+    async def read_exact(self, size: int, timeout: float) -> bytes:
+        """خواندن دقیقاً size بایت در حالت raw"""
+        protocol = self.protocol
+        protocol.raw = True
+        protocol.expect = size
+        protocol.waiter = asyncio.get_running_loop().create_future()
+        protocol.feed_raw()
+        if protocol.closed and not protocol.waiter.done():
+            raise ConnectionResetError("Connection closed by proxy")
+        return await asyncio.wait_for(protocol.waiter, timeout=timeout)
+
+    async def start_tls(self, server_hostname: str, timeout: float):
+        """ارتقای اتصال تونل شده به TLS (بدون بررسی گواهی، مثل بقیه probe ها)"""
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        self.transport = await asyncio.wait_for(
+            asyncio.get_running_loop().start_tls(self.transport, self.protocol, context,
+                                                 server_hostname=server_hostname),
+            timeout=timeout)
+
+    def close(self):
+        if not self.transport.is_closing():
+            self.transport.close()
+
+    def abort(self):
+        """بستن فوری بدون انتظار برای ارسال بافر"""
+        self.transport.abort()
@@ -0,0 +1,81 @@
+# proxy_probe_bench.py
+# بنچمارک probes/sec: کلاینت سبک proxy_probe در برابر مسیر aiohttp فعلی
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+from proxy_probe import ProbeConnection, build_proxy_request, USER_AGENT
+
+TEST_URL = 'http://www.google.com'
+
+
+async def _fake_proxy(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """پروکسی محلی که به هر درخواست 200 برمی‌گرداند"""
+    try:
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok')
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+async def _run(count: int, concurrency: int, probe) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await probe()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    return count / (time.perf_counter() - start)
+
+
+async def main(count: int, concurrency: int):
+    server = await asyncio.start_server(_fake_proxy, '127.0.0.1', 0, backlog=4096)
+    port = server.sockets[0].getsockname()[1]
+    proxy = f'http://127.0.0.1:{port}'
+    payload = build_proxy_request(TEST_URL)
+
+    async def native_probe():
+        conn = await ProbeConnection.open('127.0.0.1', port)
+        try:
+            response = await conn.request(payload, timeout=8)
+            assert response.status == 200
+        finally:
+            conn.close()
+
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def aiohttp_probe():
+            # همان فراخوانی _test_http_proxy در proxy_backend
+            async with session.get(
+                TEST_URL,
+                proxy=proxy,
+                timeout=aiohttp.ClientTimeout(total=8),
+                headers={'User-Agent': USER_AGENT},
+                ssl=False
+            ) as response:
+                assert response.status == 200
+
+        aiohttp_rate = await _run(count, concurrency, aiohttp_probe)
+    native_rate = await _run(count, concurrency, native_probe)
+
+    server.close()
+    await server.wait_closed()
+
+    print(f"Probes: {count}, concurrency: {concurrency}")
+    print(f"aiohttp : {aiohttp_rate:10.0f} probes/sec")
+    print(f"native  : {native_rate:10.0f} probes/sec ({native_rate / aiohttp_rate:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark proxy probe clients")
+    parser.add_argument('-n', '--count', type=int, default=5000)
+    parser.add_argument('-c', '--concurrency', type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.count, args.concurrency))
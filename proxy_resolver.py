@@ -0,0 +1,108 @@
+# proxy_resolver.py
+import asyncio
+import logging
+import socket
+from typing import List, Tuple
+
+from aiohttp.abc import AbstractResolver
+
+from proxy_cache import TTLCache
+from proxy_geoip import ip_to_int
+
+try:
+    import aiodns
+except ImportError:
+    # بدون aiodns از getaddrinfo حلقه (thread pool) استفاده می‌شود
+    aiodns = None
+
+logger = logging.getLogger('ProxyResolver')
+
+
+class DNSCache(TTLCache):
+    """resolve غیربلاک‌کننده IPv4 با کش بر اساس TTL، کش منفی و یکی کردن درخواست‌های همزمان"""
+
+    def __init__(self, min_ttl: float = 30, max_ttl: float = 3600, negative_ttl: float = 60,
+                 max_size: int = 10000, timeout: float = 5.0):
+        # مقدار هر host در کش: (آدرس‌ها یا None برای نتیجه منفی، پیام خطا)
+        super().__init__(max_size)
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self._resolver = None
+        self._resolver_loop = None
+
+    def _get_resolver(self):
+        # هر asyncio.run حلقه جدیدی دارد - resolver به حلقه فعلی بسته می‌شود
+        loop = asyncio.get_running_loop()
+        if self._resolver is None or self._resolver_loop is not loop:
+            self._resolver = aiodns.DNSResolver(loop=loop, timeout=self.timeout)
+            self._resolver_loop = loop
+        return self._resolver
+
+    async def resolve(self, host: str) -> List[str]:
+        """آدرس‌های IPv4 یک host - در صورت خطا socket.gaierror"""
+        if ip_to_int(host) is not None:
+            return [host]
+        host = host.lower().rstrip('.')
+
+        async def fetch():
+            try:
+                addresses, ttl = await self._lookup(host)
+            except OSError as e:
+                self.store(host, (None, e.args[-1] if e.args else f"{host}: lookup failed"), self.negative_ttl)
+                raise
+            return (addresses, ''), min(self.max_ttl, max(self.min_ttl, ttl))
+
+        addresses, error = await self.get_or_fetch(host, fetch)
+        if addresses is None:
+            raise socket.gaierror(socket.EAI_NONAME, f"{error} (cached)")
+        return addresses
+
+    async def _lookup(self, host: str) -> Tuple[List[str], float]:
+        """(آدرس‌ها، TTL) - socket.gaierror اگر نامی پیدا نشد"""
+        if aiodns is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+            addresses = list(dict.fromkeys(info[4][0] for info in infos))
+            if not addresses:
+                raise socket.gaierror(socket.EAI_NONAME, f"{host}: no IPv4 address")
+            return addresses, self.min_ttl
+
+        resolver = self._get_resolver()
+        try:
+            records = await resolver.query(host, 'A')
+            if records:
+                return [r.host for r in records], min(r.ttl for r in records)
+        except aiodns.error.DNSError:
+            pass
+        # نام‌های فایل hosts (مثل localhost) با رکورد A پیدا نمی‌شوند
+        try:
+            result = await resolver.gethostbyname(host, socket.AF_INET)
+        except aiodns.error.DNSError as e:
+            message = e.args[1] if len(e.args) > 1 else str(e)
+            raise socket.gaierror(socket.EAI_NONAME, f"{host}: {message}") from None
+        if not result.addresses:
+            raise socket.gaierror(socket.EAI_NONAME, f"{host}: no IPv4 address")
+        return list(result.addresses), self.min_ttl
+
+
+class CachedResolver(AbstractResolver):
+    """resolver برای aiohttp.TCPConnector روی DNSCache مشترک"""
+
+    def __init__(self, cache: DNSCache):
+        self.cache = cache
+
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET):
+        addresses = await self.cache.resolve(host)
+        return [{
+            'hostname': host,
+            'host': address,
+            'port': port,
+            'family': socket.AF_INET,
+            'proto': 0,
+            'flags': socket.AI_NUMERICHOST,
+        } for address in addresses]
+
+    async def close(self):
+        pass
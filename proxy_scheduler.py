@@ -0,0 +1,183 @@
+# proxy_scheduler.py
+import asyncio
+import errno
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+
+logger = logging.getLogger('ProxyScheduler')
+
+# خطاهایی که از منابع سیستم محلی می‌آیند نه از پروکسی
+LOCAL_RESOURCE_ERRNOS = {
+    errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL, errno.EADDRINUSE,
+    10024,  # WSAEMFILE
+    10048,  # WSAEADDRINUSE
+    10049,  # WSAEADDRNOTAVAIL
+    10055,  # WSAENOBUFS
+}
+
+
+class AdaptiveLimiter:
+    """کنترل‌کننده AIMD برای تعداد probe های همزمان
+
+    هر پنجره زمانی نرخ timeout، خطاهای منابع محلی و تأخیر event loop
+    بررسی می‌شود: در حالت عادی limit به صورت جمعی زیاد و با دیدن نشانه
+    ازدحام به صورت ضربی کم می‌شود.
+    """
+
+    def __init__(self, initial: int = 50, minimum: int = 10, maximum: int = 500,
+                 increase: int = 10, decrease: float = 0.7, window: float = 1.0,
+                 timeout_spike: float = 0.15, error_threshold: float = 0.02,
+                 lag_threshold: float = 0.1, min_samples: int = 20):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = max(minimum, min(initial, self.maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.timeout_spike = timeout_spike
+        self.error_threshold = error_threshold
+        self.lag_threshold = lag_threshold
+        self.min_samples = min_samples
+
+        self.in_flight = 0
+        self.history: List[Tuple[float, int]] = []
+        self._waiters = deque()
+        self._baseline_timeout_rate: Optional[float] = None
+        self._ok = 0
+        self._timeouts = 0
+        self._errors = 0
+        self._started = time.monotonic()
+
+    async def acquire(self):
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def _wake(self):
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def record(self, outcome: str):
+        """ثبت نتیجه یک تلاش: ok، timeout یا error (خطای منابع محلی)"""
+        if outcome == 'timeout':
+            self._timeouts += 1
+        elif outcome == 'error':
+            self._errors += 1
+        else:
+            self._ok += 1
+
+    def record_exception(self, exc: Optional[BaseException]):
+        """دسته‌بندی exception اتصال و ثبت آن"""
+        if exc is None or isinstance(exc, ConnectionRefusedError):
+            # رد شدن اتصال یعنی شبکه پاسخ داده است
+            self.record('ok')
+        elif isinstance(exc, asyncio.TimeoutError):
+            self.record('timeout')
+        elif isinstance(exc, OSError) and exc.errno in LOCAL_RESOURCE_ERRNOS:
+            self.record('error')
+        else:
+            self.record('ok')
+
+    def adjust(self, loop_lag: float = 0.0):
+        """یک گام AIMD بر اساس آمار پنجره فعلی"""
+        samples = self._ok + self._timeouts + self._errors
+        congested = loop_lag > self.lag_threshold
+        if samples >= self.min_samples:
+            timeout_rate = self._timeouts / samples
+            error_rate = self._errors / samples
+            baseline = self._baseline_timeout_rate
+            if baseline is not None and timeout_rate > baseline + self.timeout_spike:
+                congested = True
+            if error_rate > self.error_threshold:
+                congested = True
+            # خط مبنا فقط از پنجره‌های سالم به‌روز می‌شود
+            if not congested:
+                baseline = timeout_rate if baseline is None else baseline * 0.8 + timeout_rate * 0.2
+                self._baseline_timeout_rate = baseline
+        elif not congested:
+            # نمونه کافی نیست - limit را تغییر نده
+            self._record_history()
+            return
+
+        old_limit = self.limit
+        if congested:
+            self.limit = max(self.minimum, int(self.limit * self.decrease))
+        else:
+            self.limit = min(self.maximum, self.limit + self.increase)
+        if self.limit != old_limit:
+            logger.debug(f"Concurrency {old_limit} -> {self.limit} (lag={loop_lag:.3f}s)")
+            self._wake()
+
+        self._ok = self._timeouts = self._errors = 0
+        self._record_history()
+
+    def _record_history(self):
+        self.history.append((round(time.monotonic() - self._started, 2), self.limit))
+
+    async def run(self):
+        """حلقه کنترل - تا cancel شدن اجرا می‌شود"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.window)
+            lag = max(0.0, loop.time() - start - self.window)
+            self.adjust(lag)
+
+
+_END = object()
+
+
+async def run_worker_pool(items: Union[Iterable, AsyncIterable], worker: Callable[[Any], Awaitable], size: int,
+                          should_continue: Callable[[], bool] = None):
+    """اجرای worker روی آیتم‌های یک iterator (معمولی یا async) با size کار ثابت
+
+    فقط پنجره در جریان ساخته می‌شود؛ برخلاف ساختن یک Task برای هر آیتم،
+    حافظه به طول لیست ورودی بستگی ندارد.
+    """
+    if hasattr(items, '__aiter__'):
+        iterator = items.__aiter__()
+        # async generator همزمان فقط توسط یک worker قابل پیشروی است
+        lock = asyncio.Lock()
+
+        async def next_item():
+            async with lock:
+                return await anext(iterator, _END)
+    else:
+        iterator = iter(items)
+
+        async def next_item():
+            return next(iterator, _END)
+
+    async def runner():
+        while should_continue is None or should_continue():
+            item = await next_item()
+            if item is _END:
+                return
+            await worker(item)
+
+    await asyncio.gather(*(runner() for _ in range(max(1, size))))
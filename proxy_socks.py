@@ -0,0 +1,145 @@
+# proxy_socks.py
+# تشخیص HTTP / SOCKS4 / SOCKS5 از روی پاسخ greeting و handshake تا مقصد probe
+import socket
+import struct
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from proxy_probe import ProbeConnection
+
+# greeting SOCKS5 با روش 00 (بدون احراز هویت) و چهار روش ناشناخته 0d 0a 0d 0a:
+# سرور SOCKS5 روش‌های ناشناخته را نادیده می‌گیرد، ولی پروکسی HTTP یک بلوک هدر
+# کامل (نامعتبر) می‌بیند و به جای انتظار برای بقیه درخواست فوراً 400 برمی‌گرداند.
+SOCKS5_GREETING = b'\x05\x05\x00\r\n\r\n'
+
+_SOCKS5_ERRORS = {
+    1: 'general failure', 2: 'not allowed by ruleset', 3: 'network unreachable',
+    4: 'host unreachable', 5: 'connection refused', 6: 'TTL expired',
+    7: 'command not supported', 8: 'address type not supported',
+}
+
+
+class SocksError(ConnectionError):
+    """رد handshake یا پاسخ نامعتبر از پروکسی SOCKS"""
+
+
+async def sniff_protocol(conn: ProbeConnection, timeout: float, reset_is_socks4: bool = True) -> Optional[str]:
+    """ارسال greeting و تشخیص از دو بایت اول پاسخ - socks5، socks4، http یا None
+
+    بعد از socks5 همین اتصال برای CONNECT آماده است؛ برای بقیه باید بسته شود.
+    reset_is_socks4 فقط جایی True باشد که SOCKS محتمل است (پورت‌های SOCKS)؛
+    در غیر این صورت بستن اتصال نشانه پروتکل ناشناخته است.
+    """
+    conn.send(SOCKS5_GREETING)
+    try:
+        reply = await conn.read_exact(2, timeout)
+    except ConnectionResetError:
+        # سرور فقط-SOCKS4 معمولاً با دیدن نسخه 5 اتصال را می‌بندد
+        if reset_is_socks4:
+            return 'socks4'
+        return None
+    if reply[0] == 5:
+        if reply[1] != 0:
+            raise SocksError(f"SOCKS5 requires authentication (method {reply[1]:#04x})")
+        return 'socks5'
+    if reply[0] == 0:
+        # پاسخ رد SOCKS4 به نسخه ناشناخته
+        return 'socks4'
+    if reply == b'HT':
+        return 'http'
+    return None
+
+
+async def socks5_connect(conn: ProbeConnection, host: str, port: int, timeout: float):
+    """درخواست CONNECT بعد از greeting موفق - نام دامنه سمت پروکسی resolve می‌شود"""
+    try:
+        address = b'\x01' + socket.inet_aton(host)
+    except OSError:
+        encoded = host.encode('idna')
+        address = b'\x03' + bytes([len(encoded)]) + encoded
+    conn.send(b'\x05\x01\x00' + address + struct.pack('>H', port))
+
+    head = await conn.read_exact(4, timeout)
+    if head[0] != 5:
+        raise SocksError(f"Invalid SOCKS5 reply: {head!r}")
+    if head[1] != 0:
+        raise SocksError(f"SOCKS5 connect failed: {_SOCKS5_ERRORS.get(head[1], head[1])}")
+    # آدرس bind شده را دور می‌ریزیم
+    if head[3] == 1:
+        size = 4
+    elif head[3] == 4:
+        size = 16
+    elif head[3] == 3:
+        size = (await conn.read_exact(1, timeout))[0]
+    else:
+        raise SocksError(f"Invalid SOCKS5 address type {head[3]}")
+    await conn.read_exact(size + 2, timeout)
+
+
+async def socks4_connect(conn: ProbeConnection, host: str, port: int, timeout: float) -> str:
+    """CONNECT با SOCKS4 (آی‌پی) یا SOCKS4a (نام دامنه) - نسخه استفاده شده"""
+    try:
+        address, suffix, version = socket.inet_aton(host), b'', 'socks4'
+    except OSError:
+        address, suffix, version = b'\x00\x00\x00\x01', host.encode('idna') + b'\x00', 'socks4a'
+    conn.send(b'\x04\x01' + struct.pack('>H', port) + address + b'\x00' + suffix)
+
+    reply = await conn.read_exact(8, timeout)
+    if reply[0] != 0:
+        raise SocksError(f"Invalid SOCKS4 reply: {reply!r}")
+    if reply[1] != 0x5A:
+        raise SocksError(f"SOCKS4 connect rejected (code {reply[1]:#04x})")
+    return version
+
+
+async def socks_open(host: str, port: int, url: str, timeout: float, greeting_timeout: float = 3,
+                     connect_timeout: float = 5, resolve: Callable[[str], Awaitable[List[str]]] = None,
+                     phases: Dict[str, int] = None, conn: ProbeConnection = None,
+                     reset_is_socks4: bool = True) -> Tuple[str, ProbeConnection]:
+    """تشخیص نسخه و handshake تا مقصد url (با TLS برای https) - (پروتکل، اتصال آماده درخواست)
+
+    resolve برای SOCKS4 ساده نام مقصد را محلی resolve می‌کند؛ بدون آن SOCKS4a استفاده می‌شود.
+    phases (اختیاری) با زمان tcp/connect/tls به نانوثانیه پر می‌شود.
+    conn (اختیاری) اتصال باز و استفاده نشده به پروکسی است که تشخیص روی آن انجام می‌شود؛
+    فقط SOCKS4 بعد از greeting نسخه 5 اتصال دوم لازم دارد. در هر حال مالکیت conn منتقل می‌شود.
+    برای پروکسی HTTP یا پروتکل ناشناخته SocksError.
+    """
+    if phases is None:
+        phases = {}
+    target = urlsplit(url)
+    target_host = target.hostname
+    target_port = target.port or (443 if target.scheme == 'https' else 80)
+
+    if conn is None:
+        conn = await ProbeConnection.open(host, port, connect_timeout)
+    try:
+        handshake_start = time.perf_counter_ns()
+        protocol = await sniff_protocol(conn, min(timeout, greeting_timeout), reset_is_socks4)
+        if protocol == 'socks5':
+            await socks5_connect(conn, target_host, target_port, timeout)
+        elif protocol == 'socks4':
+            # greeting نسخه 5 اتصال را خراب کرده است
+            conn.close()
+            conn = await ProbeConnection.open(host, port, connect_timeout)
+            handshake_start = time.perf_counter_ns()
+            connect_host = target_host
+            if resolve is not None:
+                try:
+                    connect_host = (await resolve(target_host))[0]
+                except OSError:
+                    pass
+            protocol = await socks4_connect(conn, connect_host, target_port, timeout)
+        else:
+            raise SocksError(f"Not a SOCKS proxy ({protocol or 'unknown protocol'})")
+        phases['tcp'] = conn.connect_ns
+        phases['connect'] = time.perf_counter_ns() - handshake_start
+
+        if target.scheme == 'https':
+            tls_start = time.perf_counter_ns()
+            await conn.start_tls(target_host, timeout)
+            phases['tls'] = time.perf_counter_ns() - tls_start
+        return protocol, conn
+    except BaseException:
+        conn.close()
+        raise
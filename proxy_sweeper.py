@@ -0,0 +1,179 @@
+# proxy_sweeper.py
+import errno
+import logging
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+from array import array
+from collections import deque
+from typing import Callable, List, Tuple
+
+from proxy_scheduler import LOCAL_RESOURCE_ERRNOS
+
+logger = logging.getLogger('ProxySweeper')
+
+# کدهای "اتصال در جریان است" برای connect غیر بلاک‌کننده
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, 'WSAEWOULDBLOCK', 10035)}
+
+# select در ویندوز حداکثر 512 سوکت را پشتیبانی می‌کند
+_WINDOWS_SELECT_LIMIT = 500
+
+# تعداد تلاش مجدد اتصال یک هدف با کمبود منابع محلی وقتی هیچ اتصالی در جریان نیست
+_ALLOC_RETRIES = 10
+
+# بستن با RST برای جلوگیری از انباشت سوکت‌های TIME_WAIT
+_LINGER_RESET = struct.pack('hh' if sys.platform == 'win32' else 'ii', 1, 0)
+
+
+class SweepResult:
+    """نتیجه فشرده sweep: بیت‌مپ زنده/مرده، آرایه RTT به نانوثانیه و اندیس‌های خطای منابع محلی
+
+    هدفی که در local_errors است نه زنده است نه مرده - اتصالش به خاطر کمبود منابع خود ما انجام نشد.
+    """
+
+    __slots__ = ('count', 'alive', 'rtt_ns', 'local_errors')
+
+    def __init__(self, count: int):
+        self.count = count
+        self.alive = bytearray((count + 7) // 8)
+        self.rtt_ns = array('q', [-1]) * count
+        self.local_errors: List[int] = []
+
+    def mark_alive(self, index: int, rtt_ns: int):
+        self.alive[index >> 3] |= 1 << (index & 7)
+        self.rtt_ns[index] = rtt_ns
+
+    def mark_local_error(self, index: int):
+        self.local_errors.append(index)
+
+    def is_alive(self, index: int) -> bool:
+        return bool(self.alive[index >> 3] & (1 << (index & 7)))
+
+    def rtt_ms(self, index: int) -> int:
+        """RTT به میلی‌ثانیه - 9999 برای مرده‌ها"""
+        rtt = self.rtt_ns[index]
+        return rtt // 1_000_000 if rtt >= 0 else 9999
+
+
+class TCPSweeper:
+    """sweep انبوه اتصال TCP با سوکت‌های غیر بلاک‌کننده و selectors (epoll/kqueue/select)"""
+
+    def __init__(self, max_inflight: int = 10000, timeout: float = 5.0):
+        self.timeout_ns = int(timeout * 1_000_000_000)
+        self.max_inflight = max_inflight
+        if sys.platform == 'win32' and selectors.DefaultSelector is selectors.SelectSelector:
+            self.max_inflight = min(max_inflight, _WINDOWS_SELECT_LIMIT)
+
+    def sweep(self, targets: List[Tuple[str, int]], should_continue: Callable[[], bool] = None) -> SweepResult:
+        """تست اتصال همه اهداف - ترتیب نتایج با ترتیب ورودی یکسان است"""
+        result = SweepResult(len(targets))
+        selector = selectors.DefaultSelector()
+        pending = {}
+        deadlines = deque()
+        next_index = 0
+        # تلاش‌های پشت سر هم ساخت سوکت برای هدف فعلی وقتی هیچ سوکتی در جریان نیست
+        alloc_failures = 0
+
+        try:
+            while next_index < len(targets) or pending:
+                if should_continue and not should_continue():
+                    break
+
+                # پر کردن پنجره اتصال‌های در جریان
+                while next_index < len(targets) and len(pending) < self.max_inflight:
+                    index = next_index
+                    try:
+                        sock = self._start_connect(targets[index])
+                    except OSError as e:
+                        # کمبود منابع محلی - تا آزاد شدن سوکت‌ها صبر کن و همین هدف را دوباره امتحان کن
+                        if not pending:
+                            alloc_failures += 1
+                            if alloc_failures > _ALLOC_RETRIES:
+                                logger.debug(f"Local resource error for {targets[index]}: {e}")
+                                result.mark_local_error(index)
+                                alloc_failures = 0
+                                next_index += 1
+                                continue
+                            time.sleep(0.05 * alloc_failures)
+                        break
+                    alloc_failures = 0
+                    next_index += 1
+                    if sock is None:
+                        continue
+                    start = time.perf_counter_ns()
+                    pending[sock] = (index, start)
+                    deadlines.append((start + self.timeout_ns, sock))
+                    selector.register(sock, selectors.EVENT_WRITE)
+
+                if not pending:
+                    continue
+
+                wait = max(0, deadlines[0][0] - time.perf_counter_ns()) / 1_000_000_000
+                events = selector.select(timeout=min(wait, 0.05))
+                now = time.perf_counter_ns()
+
+                for key, _ in events:
+                    sock = key.fileobj
+                    index, start = pending.pop(sock)
+                    selector.unregister(sock)
+                    try:
+                        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    except OSError as e:
+                        err = e.errno
+                    if err == 0:
+                        result.mark_alive(index, now - start)
+                    elif err in LOCAL_RESOURCE_ERRNOS:
+                        result.mark_local_error(index)
+                    self._close(sock)
+
+                # حذف اتصال‌های منقضی شده - deadline ها به ترتیب شروع هستند
+                while deadlines and deadlines[0][0] <= now:
+                    _, sock = deadlines.popleft()
+                    if sock in pending:
+                        del pending[sock]
+                        selector.unregister(sock)
+                        self._close(sock)
+                while deadlines and deadlines[0][1] not in pending:
+                    deadlines.popleft()
+        finally:
+            for sock in pending:
+                selector.unregister(sock)
+                self._close(sock)
+            selector.close()
+
+        return result
+
+    def _start_connect(self, target: Tuple[str, int]):
+        """شروع connect - سوکت یا None برای شکست فوری هدف
+
+        کمبود منابع محلی (ساخت سوکت یا errno های LOCAL_RESOURCE_ERRNOS) به صورت OSError بالا می‌رود.
+        """
+        host, port = target
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            err = sock.connect_ex((host, int(port)))
+        except (OSError, ValueError) as e:
+            sock.close()
+            if isinstance(e, OSError) and e.errno in LOCAL_RESOURCE_ERRNOS:
+                raise
+            logger.debug(f"Connect failed for {host}:{port}: {e}")
+            return None
+        if err in LOCAL_RESOURCE_ERRNOS:
+            sock.close()
+            raise OSError(err, os.strerror(err))
+        if err not in _IN_PROGRESS and err != 0:
+            sock.close()
+            return None
+        return sock
+
+    @staticmethod
+    def _close(sock: socket.socket):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+        except OSError:
+            pass
+        sock.close()